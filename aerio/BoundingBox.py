@@ -3,9 +3,16 @@ import numpy as np
 
 
 class BoundingBox:
-    def __init__(self, coords, img):
+    def __init__(self, coords, img=None, shape=None):
+        """
+        @param {np.ndarray} coords The (x, y) coordinates of each point
+        @param {np.ndarray, default None} img The image that contains the bounding box
+        @param {tuple, default None} shape The (height, width) of the containing image. If None,
+        the shape of the image is used.
+        """
         self.coords = coords
         self.img = img
+        self.shape = shape if shape is not None or img is None else img.shape[:2]
 
     @property
     def x(self):
@@ -59,7 +66,7 @@ class BoundingBox:
         Calculate the minimum distance to an edge of the container
         """
         x, y = self.centroid
-        h, w = self.img.shape[0], self.img.shape[1]
+        h, w = self.shape[0], self.shape[1]
 
         return min(x, w - x, y, h - y)
 
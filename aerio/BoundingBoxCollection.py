@@ -4,6 +4,8 @@ import numpy as np
 import os
 
 from aerio.BoundingBox import BoundingBox
+from aerio.GridIndex import GridIndex
+from aerio.Mask import Mask
 from aerio import utils
 
 
@@ -12,7 +14,7 @@ class BoundingBoxCollection:
         # The photo that contains the bounding boxes
         self.photo = photo
 
-        self.boxes = self._load_boxes(boxes)
+        self.boxes = boxes
 
     def __add__(self, other):
         """
@@ -22,101 +24,323 @@ class BoundingBoxCollection:
             if self.photo != other.photo:
                 raise ValueError(
                     "To combine two BoundingBoxCollections, they must use the same photo.")
-            other_boxes = self._load_boxes(other.boxes)
+            other_coords, other_offsets = other._coords, other._offsets
         elif isinstance(other, (list, tuple, np.ndarray)):
-            other_boxes = self._load_boxes(other)
+            other_coords, other_offsets = self._load_boxes(other)
         else:
             raise ValueError("A BoundingBoxCollection can only be combined with another BoundingBoxCollection"
                              " or a list of coordinate lists.")
 
-        return BoundingBoxCollection(np.concatenate((self.boxes, other_boxes)), self.photo)
+        combined = BoundingBoxCollection([], self.photo)
+        combined._set_arrays(np.concatenate((self._coords, other_coords)),
+                             np.concatenate((self._offsets, other_offsets[1:] + self._offsets[-1])))
+
+        return combined
 
     def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            i = range(len(self))[i]
+            return BoundingBox(self._coords[self._offsets[i]:self._offsets[i + 1]], shape=self.photo.size)
+
         return self.boxes[i]
 
     def __len__(self):
-        return len(self.boxes)
+        return len(self._offsets) - 1
+
+    @property
+    def boxes(self):
+        """
+        Return an array of BoundingBox objects. The boxes share their coordinates with the collection.
+        """
+        if self._boxes is None:
+            self._boxes = np.empty(len(self), dtype=object)
+            self._boxes[:] = [self[i] for i in range(len(self))]
+
+        return self._boxes
+
+    @boxes.setter
+    def boxes(self, boxes):
+        self._set_arrays(*self._load_boxes(boxes))
+
+    def _set_arrays(self, coords, offsets):
+        """
+        Store box coordinates and cache the extents and centroids of every box.
+        """
+        # The coordinates of all boxes, concatenated. Box i spans rows offsets[i] to offsets[i + 1].
+        self._coords = coords
+        self._offsets = offsets
+        self._boxes = None
+        # The spatial index is built when it is first needed
+        self._index = None
+
+        counts = np.diff(offsets)
+        starts = offsets[:-1]
+
+        if len(counts):
+            mins = np.minimum.reduceat(coords, starts)
+            maxs = np.maximum.reduceat(coords, starts)
+            self._centroids = np.add.reduceat(
+                coords, starts) / counts[:, np.newaxis]
+        else:
+            mins = maxs = np.empty((0, 2), dtype=coords.dtype)
+            self._centroids = np.empty((0, 2))
+
+        # Extents are (top, bottom, left, right)
+        self._extents = np.stack(
+            (mins[:, 1], maxs[:, 1], mins[:, 0], maxs[:, 0]), axis=1)
 
     def _load_boxes(self, boxes):
         """
-        Take a list of BoundingBox objects or coordinates and convert to a list of BoundingBox objects.
+        Take a list of BoundingBox objects or coordinates and convert them to concatenated
+        coordinates and the offset of each box within them.
         """
         loaded = []
 
         for box in boxes:
             if isinstance(box, BoundingBox):
+                box = box.coords
+            elif not isinstance(box, (list, tuple, np.ndarray)):
+                continue
+
+            box = np.reshape(box, (-1, 2))
+            if len(box):
                 loaded.append(box)
-            elif isinstance(box, (list, tuple, np.ndarray)):
-                box = np.squeeze(box)
-                loaded.append(BoundingBox(box, self.photo.img))
-        return np.array(loaded)
 
-    def generate_mask(self, bg=255, fg=0, dtype=np.uint8):
+        offsets = np.zeros(len(loaded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(box) for box in loaded])
+        coords = np.concatenate(loaded) if loaded else np.empty(
+            (0, 2), dtype=np.int32)
+
+        return coords, offsets
+
+    def _polygons(self):
+        """
+        Return a list of the coordinate arrays of each box.
+        """
+        return [self._coords[start:end] for start, end in zip(self._offsets[:-1], self._offsets[1:])]
+
+    def _select(self, selected):
+        """
+        Keep only the boxes selected by a boolean array.
+        """
+        counts = np.diff(self._offsets)
+        coords = self._coords[np.repeat(selected, counts)]
+
+        offsets = np.zeros(np.count_nonzero(selected) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts[selected])
+
+        self._set_arrays(coords, offsets)
+
+    def _subset(self, indices):
+        """
+        Return a new collection containing the boxes at the given indices, in order.
+        """
+        starts, ends = self._offsets[:-1][indices], self._offsets[1:][indices]
+        counts = ends - starts
+
+        # The position of every coordinate of every selected box
+        points = np.arange(counts.sum()) + \
+            np.repeat(starts - (np.cumsum(counts) - counts), counts)
+
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+
+        subset = BoundingBoxCollection([], self.photo)
+        subset._set_arrays(self._coords[points], offsets)
+
+        return subset
+
+    @property
+    def index(self):
+        """
+        Return a spatial index of the box extents, building it if needed.
+        """
+        if self._index is None:
+            self._index = GridIndex(self._extents)
+
+        return self._index
+
+    def query(self, extent):
+        """
+        Return the boxes whose extents intersect a region.
+        @param {tuple} extent The (top, bottom, left, right) extent of the region
+        @return {BoundingBoxCollection} The intersecting boxes
+        """
+        return self._subset(self.index.query(extent))
+
+    def nearest(self, point, k=1):
+        """
+        Return the boxes whose extents are nearest to a point, such as a fiducial.
+        @param {tuple} point The (x, y) point to search from
+        @param {int, default 1} k The number of boxes to return
+        @return {BoundingBoxCollection} The nearest boxes, nearest first
+        """
+        return self._subset(self.index.nearest(point, k))
+
+    def intersecting(self, other):
+        """
+        Return the boxes whose extents intersect any box extent in another collection.
+        @param {BoundingBoxCollection} other The boxes to check against
+        @return {BoundingBoxCollection} The intersecting boxes
+        """
+        found = [self.index.query(extent) for extent in other.extents]
+        indices = np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+        return self._subset(indices)
+
+    @property
+    def extents(self):
+        """
+        Return the extent (top, bottom, left, right) of each box
+        """
+        return self._extents
+
+    @property
+    def heights(self):
+        """
+        Return the height of each box
+        """
+        return self._extents[:, 1] - self._extents[:, 0]
+
+    @property
+    def widths(self):
+        """
+        Return the width of each box
+        """
+        return self._extents[:, 3] - self._extents[:, 2]
+
+    @property
+    def areas(self):
+        """
+        Return the area of each box's extent
+        """
+        return self.heights * self.widths
+
+    @property
+    def centroids(self):
+        """
+        Return the centroid (x, y) of each box
+        """
+        return self._centroids
+
+    @property
+    def hw_ratios(self):
+        """
+        Return the height to width ratio of each box
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.heights / self.widths
+
+    @property
+    def edge_distances(self):
+        """
+        Return the minimum distance from each box centroid to an edge of the photo
+        """
+        x, y = self._centroids[:, 0], self._centroids[:, 1]
+        h, w = self.photo.size
+
+        return np.min((x, w - x, y, h - y), axis=0)
+
+    def generate_mask(self, bg=255, fg=0, dtype=np.uint8, roi=False):
         """
         Convert the bounding boxes to a raster mask
+        @param {bool, default False} roi If true, only rasterize the region of the photo that
+        contains the boxes and return the mask along with the (top, left) position of that region.
+        Otherwise, the mask covers the full photo.
         """
-        mask = self._bbox_to_array(self.boxes, bg, fg, dtype)
+        if roi:
+            top, bottom, left, right = self._region()
+            mask = self._bbox_to_array(
+                self._polygons(), bg, fg, dtype, region=(top, bottom, left, right))
+
+            return mask, (top, left)
+
+        mask = self._bbox_to_array(self._polygons(), bg, fg, dtype)
 
         return mask
 
-    def save_mask(self, path, suffix="_mask", bg=255, fg=0, dtype=np.uint8):
+    def to_mask(self):
+        """
+        Convert the bounding boxes to a compact Mask that is only rasterized when needed
+        """
+        return Mask(self.photo.size, polygons=self._polygons())
+
+    def save_mask(self, path, suffix="_mask", bg=255, fg=0, dtype=np.uint8, compact=None):
+        """
+        Save the bounding boxes as a mask image
+        @param {str, default None} compact If "polygons", "packed", or "rle", save a compact Mask
+        in that form to an .npz file and return the Mask instead of writing a mask image.
+        """
+        if compact is not None:
+            out_path = os.path.join(path, self.photo.filename + ".npz")
+            out_path = utils.add_suffix(out_path, suffix)
+
+            mask = self.to_mask()
+            mask.save(out_path, form=compact)
+
+            return mask
+
         out_path = os.path.join(
             path, self.photo.filename + self.photo.extension)
         out_path = utils.add_suffix(out_path, suffix)
 
         mask = self.generate_mask(bg, fg, dtype)
 
-        cv2.imwrite(out_path, mask)
+        utils.write_image(out_path, mask)
 
         return mask
 
-    def filter(self, min_area=-np.Inf,
-               max_area=np.Inf,
-               min_edge_distance=-np.Inf,
-               max_edge_distance=np.Inf,
-               min_hw_ratio=-np.Inf,
-               max_hw_ratio=np.Inf):
+    def filter(self, min_area=-np.inf,
+               max_area=np.inf,
+               min_edge_distance=-np.inf,
+               max_edge_distance=np.inf,
+               min_hw_ratio=-np.inf,
+               max_hw_ratio=np.inf):
         """
         Remove all boxes that don't match specified criteria
         """
-        filtered_boxes = self.boxes.copy()
-
-        areas = [box.area for box in filtered_boxes]
-        filtered_boxes = self._filter_boxes(
-            filtered_boxes, min_area, max_area, areas)
-
-        edge_distances = [box.edge_distance for box in filtered_boxes]
-        filtered_boxes = self._filter_boxes(
-            filtered_boxes, min_edge_distance, max_edge_distance, edge_distances)
+        selected = self._filter_boxes(self.areas, min_area, max_area)
+        selected &= self._filter_boxes(
+            self.edge_distances, min_edge_distance, max_edge_distance)
+        selected &= self._filter_boxes(
+            self.hw_ratios, min_hw_ratio, max_hw_ratio)
 
-        hw_ratios = [box.hw_ratio for box in filtered_boxes]
-        filtered_boxes = self._filter_boxes(
-            filtered_boxes, min_hw_ratio, max_hw_ratio, hw_ratios)
+        self._select(selected)
 
-        self.boxes = filtered_boxes
-
-    def _filter_boxes(self, boxes, min_val, max_val, vals):
+    def _filter_boxes(self, vals, min_val, max_val):
         """
-        Filter boxes based on a list of box attributes and an allowable range.
+        Return a boolean array of the boxes with attributes within an allowable range.
         """
-        filter_vector = np.greater(vals, min_val) & np.less(vals, max_val)
-        return boxes[filter_vector]
+        return np.greater(vals, min_val) & np.less(vals, max_val)
 
-    def preview(self, size=(8, 8), line_color=(255, 0, 0), fill_color=(255, 0, 0), line_width=2, line_alpha=1, fill_alpha=0.25):
+    def preview(self, size=(8, 8), line_color=(255, 0, 0), fill_color=(255, 0, 0), line_width=2, line_alpha=1, fill_alpha=0.25,
+                downsample=True):
         """
         Draw fills and outlines of each bounding box. Then blend them onto the photo image and display it.
+        @param {bool, default True} downsample If true, boxes are drawn onto the photo image downsampled
+        to the resolution of the plot, with line widths measured in downsampled pixels.
         """
-        img = self.photo.img.copy()
+        _, ax = plt.subplots(figsize=size)
+
+        if downsample:
+            img = self.photo.preview_image(ax)
+        else:
+            img = self.photo.img
+
         img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
 
+        # Scale box coordinates from the photo to the preview image
+        scale = np.array([img.shape[1] / self.photo.width,
+                         img.shape[0] / self.photo.height])
+
         # Promote pixel depth to allow filling with any 8-bit value. If these were np.zeros, then filling
         # with black would confuse the mask generation.
         fills = np.full(img.shape, (256, 256, 256), dtype=np.uint16)
         lines = np.full(img.shape, (256, 256, 256), dtype=np.uint16)
 
-        for box in self.boxes:
-            if box:
-                box._draw(fills, lines, line_color, fill_color, line_width)
+        for coords in self._polygons():
+            box = BoundingBox(np.round(coords * scale).astype(np.int32))
+            box._draw(fills, lines, line_color, fill_color, line_width)
 
         # Mask the pixels that contain fills or lines
         fill_mask = np.all(fills == fill_color, axis=-1)
@@ -130,35 +354,150 @@ class BoundingBoxCollection:
         img[line_mask] = (lines[line_mask] *
                           line_alpha) + (img[line_mask] * (1 - line_alpha))
 
-        _, ax = plt.subplots(figsize=size)
-        ax.imshow(img)
+        ax.imshow(img, extent=self.photo.preview_extent)
 
-    def collapse(self, kernel=np.ones((5, 5), np.uint8), iterations=3):
+    def collapse(self, kernel=np.ones((5, 5), np.uint8), iterations=3, geometric=False, gap=None):
         """
         Use morphological opening to collapse and combine bounding boxes
+        @param {bool, default False} geometric If true, merge boxes by comparing their extents
+        instead of rasterizing them, which takes time proportional to the number of boxes rather
+        than the photo size. Each merged group becomes the rectangle around its extents, so this
+        suits small boxes such as label candidates rather than rings such as border boxes.
+        @param {tuple, default None} gap The maximum (vertical, horizontal) distance between the
+        edges of boxes that are merged in geometric mode. If None, the kernel shape is used, which
+        closely matches the raster opening. Diagonal neighbors may be merged more readily.
         """
-        mask = self.generate_mask()
+        if not len(self):
+            return
+
+        if geometric:
+            self._collapse_extents(kernel.shape if gap is None else gap)
+            return
+
+        # Only the region around the boxes is processed. It is padded by the reach of the kernel so
+        # that the opening matches the opening of a full photo mask.
+        padding = np.array(kernel.shape) * iterations
+        top, bottom, left, right = self._region(padding)
+
+        # Boxes that lie entirely outside of the photo leave nothing to collapse
+        if bottom <= top or right <= left:
+            self._set_arrays(*self._load_boxes([]))
+            return
+
+        mask = self._bbox_to_array(
+            self._polygons(), region=(top, bottom, left, right))
         mask_collapsed = cv2.morphologyEx(
             mask, cv2.MORPH_OPEN, kernel, iterations)
 
-        self.boxes = self._array_to_bbox(mask_collapsed)
+        self._set_arrays(
+            *self._array_to_bbox(mask_collapsed, offset=(left, top)))
+
+    def _collapse_extents(self, gap):
+        """
+        Merge boxes whose extents are within a (vertical, horizontal) gap of each other into the
+        rectangles around each merged group.
+        """
+        gap_y, gap_x = gap
+        top, bottom, left, right = self._extents.T
+
+        # Boxes are within the gap of each other when their extents, grown by the gap on the
+        # bottom and right, intersect. A grid over the grown extents only compares nearby boxes.
+        grown = np.stack((top, bottom + gap_y, left, right + gap_x), axis=1)
+        first, second = GridIndex(grown).intersecting_pairs()
+
+        groups = self._connected_components(len(self), first, second)
+
+        # Relabel groups in order of their first box
+        _, first_boxes, labels = np.unique(
+            groups, return_index=True, return_inverse=True)
+        n_groups = len(first_boxes)
+
+        merged_top = np.full(n_groups, np.inf)
+        merged_left = np.full(n_groups, np.inf)
+        merged_bottom = np.full(n_groups, -np.inf)
+        merged_right = np.full(n_groups, -np.inf)
+        np.minimum.at(merged_top, labels, top)
+        np.minimum.at(merged_left, labels, left)
+        np.maximum.at(merged_bottom, labels, bottom)
+        np.maximum.at(merged_right, labels, right)
+
+        corners = np.stack((merged_left, merged_top, merged_right, merged_top, merged_right,
+                            merged_bottom, merged_left, merged_bottom), axis=1)
+
+        self._set_arrays(corners.reshape(-1, 2).astype(self._coords.dtype),
+                         np.arange(n_groups + 1, dtype=np.int64) * 4)
+
+    def _connected_components(self, n, first, second):
+        """
+        Label the connected components of a graph with n nodes and edges between each first and
+        second node. Every node is labeled with the lowest node in its component.
+        """
+        labels = np.arange(n)
+
+        while True:
+            # Hook the root of each edge's higher component onto the lower component
+            low = np.minimum(labels[first], labels[second])
+            hooked = labels.copy()
+            np.minimum.at(hooked, labels[first], low)
+            np.minimum.at(hooked, labels[second], low)
+
+            # Point every node directly at its root
+            while True:
+                jumped = hooked[hooked]
+                if (jumped == hooked).all():
+                    break
+                hooked = jumped
+
+            if (hooked == labels).all():
+                return labels
+
+            labels = hooked
+
+    def _region(self, padding=(0, 0)):
+        """
+        Return the (top, bottom, left, right) region of the photo that contains every box, padded
+        by a (vertical, horizontal) distance and clipped to the photo. The bottom and right edges
+        are exclusive.
+        """
+        height, width = self.photo.size
+
+        if not len(self):
+            return 0, 0, 0, 0
+
+        pad_y, pad_x = padding
+        top, left = np.floor(self._extents[:, [0, 2]].min(axis=0))
+        bottom, right = np.ceil(self._extents[:, [1, 3]].max(axis=0)) + 1
 
-    def _bbox_to_array(self, bbox, bg=255, fg=0, dtype=np.uint8):
+        top = int(np.clip(top - pad_y, 0, height))
+        bottom = int(np.clip(bottom + pad_y, top, height))
+        left = int(np.clip(left - pad_x, 0, width))
+        right = int(np.clip(right + pad_x, left, width))
+
+        return top, bottom, left, right
+
+    def _bbox_to_array(self, polygons, bg=255, fg=0, dtype=np.uint8, region=None):
         """
-        Convert a list of Bounding Box objects into a 2D array. Boxes will be
-        filled with the foreground value.
+        Convert a list of box coordinate arrays into a 2D array. Boxes will be
+        filled with the foreground value. If a (top, bottom, left, right) region
+        is given, the array only covers that region of the photo.
         """
-        array = np.full(self.photo.img.shape, fill_value=bg, dtype=dtype)
+        if region is None:
+            region = (0, self.photo.size[0], 0, self.photo.size[1])
+
+        top, bottom, left, right = region
+        array = np.full((bottom - top, right - left), fill_value=bg, dtype=dtype)
 
-        for box in bbox:
-            cv2.fillPoly(array, pts=[box.coords], color=fg, lineType=None)
+        for coords in polygons:
+            cv2.fillPoly(array, pts=[coords], color=fg,
+                         lineType=None, offset=(-left, -top))
 
         return array
 
-    def _array_to_bbox(self, array, bg=255, fg=0):
+    def _array_to_bbox(self, array, bg=255, fg=0, offset=(0, 0)):
         """
-        Convert an 2D array into a list of Bounding Box objects. The foreground
-        values will become the boxes.
+        Convert an 2D array into box coordinates and offsets. The foreground
+        values will become the boxes. Coordinates are shifted by an (x, y) offset
+        to place an array region back in the photo.
         """
         working_array = array.copy()
         # CV2 wants black background with white objects
@@ -166,7 +505,7 @@ class BoundingBoxCollection:
         working_array[array == fg] = 255
 
         contours, _ = cv2.findContours(
-            working_array, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+            working_array, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
 
         boxes = self._load_boxes(contours)
 
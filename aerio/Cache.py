@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+
+from aerio.BoundingBoxCollection import BoundingBoxCollection
+from aerio import utils
+
+
+class _CachedBoxes:
+    """
+    The coordinates of a BoundingBoxCollection, stored without its photo
+    """
+
+    def __init__(self, boxes):
+        self.coords = boxes._coords
+        self.offsets = boxes._offsets
+
+    def to_boxes(self, photo):
+        boxes = BoundingBoxCollection([], photo)
+        boxes._set_arrays(self.coords, self.offsets)
+
+        return boxes
+
+
+class Cache:
+    """
+    A persistent on-disk cache of processing results, such as fiducials, histograms, bounding boxes,
+    and processed images. Results are keyed by the content of the photo they were computed from, the
+    operation, and its parameters, so changing a parameter or a source file only recomputes the
+    results that depend on it. When the cache grows past its size limit, the least recently used
+    results are removed.
+    """
+
+    # The extension of cached results
+    EXTENSION = ".pkl"
+
+    def __init__(self, directory, max_size=None):
+        """
+        @param {str} directory The directory to store results in
+        @param {int, default None} max_size The maximum total size of stored results in bytes. If
+        None, results are never removed.
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+        # The total size of stored results, measured when it is first needed
+        self._size = None
+        # Content hashes of source files, keyed by (path, modification time, size)
+        self._source_hashes = {}
+
+        os.makedirs(os.path.join(directory, "sources"), exist_ok=True)
+
+    def __repr__(self):
+        return f"Cache(\"{self.directory}\", max_size={self.max_size})"
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def key(self, photo, operation, params=None):
+        """
+        Return the key of an operation applied to a photo in its current state
+        @param {Photo} photo The photo that the operation is applied to
+        @param {str} operation The name of the operation
+        @param {dict, default None} params Every parameter that affects the result
+        @return {str} The key
+        """
+        digest = hashlib.md5()
+        digest.update(self._photo_hash(photo).encode())
+        utils.update_hash(digest, operation)
+        utils.update_hash(digest, params or {})
+
+        return digest.hexdigest()
+
+    def get(self, key, default=None):
+        """
+        Return a stored result, or a default if it isn't stored
+        """
+        path = self._path(key)
+
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return default
+
+        # The modification time records when each result was last used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return value
+
+    def set(self, key, value):
+        """
+        Store a result, removing the least recently used results if the cache is full
+        """
+        path = self._path(key)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+
+        # Write to a temporary file first so that a partial result is never read
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+        if self._size is not None:
+            self._size += os.path.getsize(path) - previous
+
+        if self.max_size is not None and self.size > self.max_size:
+            self._evict(keep=path)
+
+    def memoize(self, photo, operation, fn, **params):
+        """
+        Return the stored result of an operation on a photo, computing and storing it if it isn't
+        stored. BoundingBoxCollections are stored without their photo and returned with this photo.
+        @param {Photo} photo The photo that the operation is applied to
+        @param {str} operation The name of the operation
+        @param {function} fn A function that takes the photo and params and returns the result
+        @return The result
+        """
+        key = self.key(photo, operation, params)
+        value = self.get(key, default=self)
+
+        if value is self:
+            value = fn(photo, **params)
+            self.set(key, _CachedBoxes(value) if isinstance(
+                value, BoundingBoxCollection) else value)
+        elif isinstance(value, _CachedBoxes):
+            value = value.to_boxes(photo)
+
+        return value
+
+    @property
+    def size(self):
+        """
+        Return the total size of stored results in bytes
+        """
+        if self._size is None:
+            self._size = sum(entry.stat().st_size for entry in self._entries())
+
+        return self._size
+
+    def clear(self):
+        """
+        Remove every stored result
+        """
+        for entry in self._entries():
+            os.remove(entry.path)
+
+        self._size = 0
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory)
+                if entry.is_file() and entry.name.endswith(self.EXTENSION)]
+
+    def _evict(self, keep=None):
+        """
+        Remove the least recently used results until the cache fits within its size limit
+        """
+        entries = sorted(((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path)
+                          for entry in self._entries()))
+        self._size = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            if path == keep:
+                continue
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.EXTENSION)
+
+    def _photo_hash(self, photo):
+        """
+        Return a hash of a photo's current image. Images that haven't been modified since they
+        were read are identified by their source file and lazy crops, so they don't need to be
+        read. Modified images are hashed directly.
+        """
+        digest = hashlib.md5()
+
+        if photo.is_loaded and photo._modified:
+            utils.update_hash(digest, photo.img)
+        else:
+            utils.update_hash(digest, (self._source_hash(photo.path), photo._crop_windows,
+                                  np.dtype(photo.dtype).name))
+
+        return digest.hexdigest()
+
+    def _source_hash(self, path):
+        """
+        Return a hash of a file's content. Hashes are stored with the file's modification time and
+        size so that unchanged files are only hashed once.
+        """
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        source = (path, stat.st_mtime_ns, stat.st_size)
+
+        if source in self._source_hashes:
+            return self._source_hashes[source]
+
+        name = hashlib.md5(path.encode()).hexdigest() + ".json"
+        record_path = os.path.join(self.directory, "sources", name)
+
+        try:
+            with open(record_path) as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            record = None
+
+        if record and (record["mtime"], record["size"]) == (stat.st_mtime_ns, stat.st_size):
+            content_hash = record["hash"]
+        else:
+            digest = hashlib.md5()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            content_hash = digest.hexdigest()
+
+            temp_path = f"{record_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"mtime": stat.st_mtime_ns, "size": stat.st_size,
+                           "hash": content_hash}, f)
+            os.replace(temp_path, record_path)
+
+        self._source_hashes[source] = content_hash
+
+        return content_hash
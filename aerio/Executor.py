@@ -0,0 +1,48 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class Executor:
+    """
+    Dispatch per-photo work serially or across a pool of threads or processes.
+    """
+    SERIAL = "serial"
+    THREAD = "thread"
+    PROCESS = "process"
+
+    def __init__(self, kind=SERIAL, workers=None):
+        """
+        @param {str, default "serial"} kind How work is dispatched: "serial", "thread", or "process".
+        @param {int, default None} workers The maximum number of workers in a pool. If None, the
+        number of processors on the machine is used.
+        """
+        if kind not in (self.SERIAL, self.THREAD, self.PROCESS):
+            raise ValueError(
+                f"Executor kind must be \"{self.SERIAL}\", \"{self.THREAD}\", or \"{self.PROCESS}\", not \"{kind}\".")
+
+        self.kind = kind
+        self.workers = workers
+
+    def __repr__(self):
+        return f"Executor(kind=\"{self.kind}\", workers={self.workers})"
+
+    def map(self, fn, *iterables, initializer=None, initargs=()):
+        """
+        Apply a function to every item of the iterables, yielding results in order. When using a
+        process pool, the function and its arguments must be picklable, so it should be defined at
+        the top level of a module.
+        @param {function, default None} initializer A function called with initargs in each worker
+        before it runs any tasks, or once in this process when work is dispatched serially. Large
+        arguments that every task needs can be sent to each worker process once this way, rather
+        than with every task.
+        """
+        if self.kind == self.SERIAL or self.workers == 1:
+            if initializer is not None:
+                initializer(*initargs)
+
+            yield from map(fn, *iterables)
+            return
+
+        pool = ThreadPoolExecutor if self.kind == self.THREAD else ProcessPoolExecutor
+
+        with pool(max_workers=self.workers, initializer=initializer, initargs=initargs) as executor:
+            yield from executor.map(fn, *iterables)
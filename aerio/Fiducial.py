@@ -10,6 +10,28 @@ class Fiducial:
         # Top-left corner coordinates in image
         self._position = position
         self._coordinates = None
+        # How confidently the fiducial was located. The response is the minimum eigenvalue of the
+        # detected corner and the score is the normalized cross correlation of a template match,
+        # whichever method located the fiducial. Symmetry is the distance in pixels from the
+        # position mirrored from the opposite fiducial (the same for all four fiducials of a
+        # photo, as four points only show one asymmetry), and deviation is the distance in pixels
+        # from the position expected from the fiducials of other photos.
+        self.quality = {"response": None, "score": None,
+                        "symmetry": None, "deviation": None}
+
+    @staticmethod
+    def from_coordinates(coordinates):
+        """
+        Create a fiducial from known coordinates within the image, e.g. coordinates recorded by a
+        previous run. The fiducial has no image, so it can't be previewed on its own, filtered, or
+        used as a template.
+        @param {tuple} coordinates The (x, y) coordinates of the fiducial in the image
+        @return {Fiducial} The fiducial
+        """
+        fiducial = Fiducial(None, (0, 0))
+        fiducial._coordinates = (np.float32(coordinates[0]), np.float32(coordinates[1]))
+
+        return fiducial
 
     def _filter(self, kernel_size, iterations, threshold, block_size):
         """
@@ -30,17 +52,69 @@ class Fiducial:
 
         return filtered
 
-    def _calculate_coordinates(self, kernel_size, iterations, threshold, block_size):
+    def _calculate_coordinates(self, kernel_size, iterations, threshold, block_size, subpixel=False):
         """
         Perform image filtering and corner finding to locate the fiducial coordinates.
+        @param {bool, default False} subpixel If true, the corner is refined to sub-pixel accuracy.
         """
         self._filtered = self._filter(
             kernel_size, iterations, threshold, block_size)
 
-        self._coordinates = self._locate_corner()
+        corner = self._locate_corner()
+
+        self._set_corner(corner, self._filtered,
+                         max(kernel_size // 2, 2) if subpixel else None)
 
         return self.coordinates
 
+    def _set_corner(self, corner, filtered, subpixel_size=None):
+        """
+        Store a corner found in a filtered image with its corner response, optionally refining
+        it to sub-pixel accuracy within a window of a given half size.
+        """
+        self._coordinates = corner
+        self.quality["response"] = None
+
+        if corner is None:
+            return
+
+        self.quality["response"] = self._corner_response(filtered, corner)
+
+        if subpixel_size:
+            self._coordinates = self._subpixel(filtered, corner, subpixel_size)
+
+    def _corner_response(self, filtered, corner):
+        """
+        Return the minimum eigenvalue corner response of a filtered image at a corner, as used by
+        cv2.goodFeaturesToTrack. Only the pixels around the corner are used.
+        """
+        x, y = int(round(float(corner[0]))), int(round(float(corner[1])))
+        height, width = filtered.shape[:2]
+
+        # The response depends on pixels within two of the corner, so a slightly larger patch
+        # gives the same value as the whole image
+        top, left = max(y - 3, 0), max(x - 3, 0)
+        patch = filtered[top:min(y + 4, height), left:min(x + 4, width)]
+
+        return float(cv2.cornerMinEigenVal(patch, 3, 3)[y - top, x - left])
+
+    def _subpixel(self, filtered, corner, size):
+        """
+        Refine a corner in a filtered image to sub-pixel accuracy with cv2.cornerSubPix, using a
+        search window with a given half size.
+        """
+        corner = np.array([[corner]], dtype=np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS +
+                    cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+        refined = cv2.cornerSubPix(filtered, corner.copy(), (size, size), (-1, -1),
+                                   criteria)[0][0]
+
+        # Sub-pixel refinement can drift along straight edges, so it is only kept if it stays close
+        if np.abs(refined - corner[0][0]).max() > 1:
+            refined = corner[0][0]
+
+        return (np.float32(refined[0]), np.float32(refined[1]))
+
     def _locate_corner(self):
         """
         Take a filtered image of a fiducial and find the best corner feature. 
@@ -49,17 +123,28 @@ class Fiducial:
         corner = cv2.goodFeaturesToTrack(
             self._filtered, maxCorners=1, qualityLevel=0.1, minDistance=0)
 
+        if corner is None:
+            return None
+
         return (corner[0][0][0], corner[0][0][1])
 
     @property
     def coordinates(self):
         """
-        Convert the local cropped coordinates to coordinates within the image.
+        Convert the local cropped coordinates to coordinates within the image. Returns None if
+        the fiducial couldn't be located.
         """
+        if self._coordinates is None:
+            return None
+
         return (self._position[1] + self._coordinates[0], self._position[0] + self._coordinates[1])
 
     def preview(self, size=(4, 4), cmap="gray", filtered=False, ax=None, index=None):
         if ax is None:
+            if self.img is None:
+                raise ValueError(
+                    "This fiducial has no image. Only its coordinates can be added to a photo preview.")
+
             _, ax = plt.subplots(figsize=size)
 
             if filtered and self._filtered is not None:
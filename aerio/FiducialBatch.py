@@ -0,0 +1,157 @@
+import cv2
+import numpy as np
+
+
+class FiducialBatch:
+    """
+    Locate fiducials across many photos at once. Fiducial crops at the same position are stacked
+    into a single array so that filtering and corner finding run as a few whole-array operations
+    instead of once per crop. Results match locating each photo's fiducials individually.
+    """
+
+    def __init__(self, photos):
+        self.photos = photos
+
+    def locate(self, size, kernel_size=None, iterations=4, threshold=False, block_size=999,
+               windows=None, subpixel=False):
+        """
+        Extract fiducials from every photo, then filter and locate the corners of all fiducials
+        at each position together. Results are stored in each photo's Fiducials.
+        @param {list, default None} windows A search window for each fiducial position, as in
+        Fiducials.locate
+        @param {bool, default False} subpixel If true, corners are refined to sub-pixel accuracy
+        """
+        groups = {}
+
+        for photo in self.photos:
+            fiducials = photo.fiducials
+            fiducials.fiducials = fiducials._crop_fiducials(size, windows)
+
+            # The default kernel size depends on the photo size, so group fiducials that share one
+            photo_kernel_size = kernel_size or photo.height // 200
+
+            for position, fiducial in enumerate(fiducials.fiducials):
+                key = (position, fiducial.img.shape, photo_kernel_size)
+                groups.setdefault(key, []).append(fiducial)
+
+        for (_, _, group_kernel_size), group in groups.items():
+            stack = np.stack([fiducial.img for fiducial in group])
+            filtered = self._filter(
+                stack, group_kernel_size, iterations, threshold, block_size)
+            corners = self._locate_corners(filtered)
+
+            for fiducial, img, corner in zip(group, filtered, corners):
+                fiducial._filtered = img
+                fiducial._set_corner(corner, img, max(
+                    group_kernel_size // 2, 2) if subpixel else None)
+
+        for photo in self.photos:
+            photo.fiducials._score_symmetry()
+
+        return [photo.fiducials.coordinates for photo in self.photos]
+
+    def _filter(self, stack, kernel_size, iterations, threshold, block_size):
+        """
+        Use morphological opening and adaptive thresholding to filter a stack of fiducial images.
+        The images are tiled into one array, separated by gaps wide enough that the kernel can't
+        reach from one image into the next.
+        """
+        kernel = np.ones((kernel_size, kernel_size), np.uint8)
+        n, height, width = stack.shape
+        gap = kernel_size * iterations
+
+        tiled = np.empty((n, height + gap, width), np.uint8)
+
+        # Normalizing is cheap, so each image is normalized directly into the tiled array
+        for img, tile in zip(stack, tiled):
+            cv2.normalize(img, tile[:height], alpha=0, beta=255,
+                          norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+
+        tiled = tiled.reshape(n * (height + gap), width)
+        gaps = tiled.reshape(n, height + gap, width)[:, height:]
+
+        # Opening erodes then dilates. The gaps are filled with a value that never wins each
+        # operation, as if every image were padded with OpenCV's default morphology border.
+        gaps[:] = 255
+        tiled = cv2.erode(tiled, kernel, iterations=iterations)
+        tiled.reshape(n, height + gap, width)[:, height:] = 0
+        tiled = cv2.dilate(tiled, kernel, iterations=iterations)
+
+        filtered = tiled.reshape(n, height + gap, width)[:, :height]
+
+        if threshold:
+            filtered = np.stack([cv2.adaptiveThreshold(img, img.max(), cv2.ADAPTIVE_THRESH_MEAN_C,
+                                                       cv2.THRESH_BINARY, block_size, 0) for img in filtered])
+
+        return filtered
+
+    def _corner_response(self, filtered):
+        """
+        Calculate the minimum eigenvalue corner response of each image in a stack, matching
+        cv2.cornerMinEigenVal with a block size and aperture of 3. Each image is reflected by one
+        pixel before tiling, so that the borders match the response of each image on its own.
+        """
+        n, height, width = filtered.shape
+
+        # Derivatives are scaled as cv2.cornerMinEigenVal scales them for 8-bit images
+        scale = 1. / (4 * 3 * 255)
+
+        padded = np.pad(filtered, ((0, 0), (1, 1), (1, 1)), mode="reflect")
+        padded = padded.reshape(n * (height + 2), width + 2)
+        dx = cv2.Sobel(padded, cv2.CV_32F, 1, 0, ksize=3, scale=scale)
+        dy = cv2.Sobel(padded, cv2.CV_32F, 0, 1, ksize=3, scale=scale)
+        dx = dx.reshape(n, height + 2, width + 2)[:, 1:-1, 1:-1]
+        dy = dy.reshape(n, height + 2, width + 2)[:, 1:-1, 1:-1]
+
+        cov = np.stack((dx * dx, dx * dy, dy * dy), axis=-1)
+        cov = np.pad(cov, ((0, 0), (1, 1), (1, 1), (0, 0)), mode="reflect")
+        cov = cv2.boxFilter(cov.reshape(n * (height + 2), width + 2, 3), cv2.CV_32F, (3, 3),
+                            normalize=False)
+        cov = cov.reshape(n, height + 2, width + 2, 3)[:, 1:-1, 1:-1]
+
+        a = cov[..., 0] * np.float32(0.5)
+        b = cov[..., 1]
+        c = cov[..., 2] * np.float32(0.5)
+
+        return (a + c) - np.sqrt((a - c) * (a - c) + b * b)
+
+    def _locate_corners(self, filtered, quality_level=0.1):
+        """
+        Find the best corner feature in each image of a filtered stack, matching
+        cv2.goodFeaturesToTrack with maxCorners=1. Return a list of (x, y) coordinates, with None
+        for images that have no corners.
+        """
+        n, height, width = filtered.shape
+        response = self._corner_response(filtered)
+
+        # Corners must exceed a fraction of the strongest response in their image...
+        thresholds = response.max(axis=(1, 2), keepdims=True) * quality_level
+        response = np.where(response > thresholds, response, 0)
+
+        # ...and be the maximum of their 3x3 neighborhood
+        padded = np.pad(response, ((0, 0), (1, 1), (1, 1)),
+                        constant_values=-np.inf)
+        local_max = np.max([padded[:, i:i + height, j:j + width]
+                            for i in range(3) for j in range(3)], axis=0)
+        candidates = (response > thresholds) & (response == local_max)
+
+        # Corners are never found on the outer pixels of an image
+        candidates[:, [0, -1], :] = False
+        candidates[:, :, [0, -1]] = False
+
+        scores = np.where(candidates, response, -1).reshape(n, -1)
+
+        # Ties are broken in favor of the last pixel, as in cv2.goodFeaturesToTrack
+        last = scores.shape[1] - 1
+        best = last - np.argmax(scores[:, ::-1], axis=1)
+
+        corners = []
+        for index, score in zip(best, scores[np.arange(n), best]):
+            if score < 0:
+                corners.append(None)
+                continue
+
+            y, x = divmod(index, width)
+            corners.append((np.float32(x), np.float32(y)))
+
+        return corners
@@ -0,0 +1,212 @@
+import cv2
+import numpy as np
+
+
+class FiducialTemplate:
+    """
+    Templates of the fiducials of one camera, extracted from a photo whose fiducials have been
+    located. Fiducials in other photos from the same camera are located by normalized cross
+    correlation with the templates. Correlation is computed with FFTs, and the FFT of each
+    template is cached for each fiducial window shape, so each photo only needs the FFT of its own
+    fiducial windows.
+    """
+
+    def __init__(self, fiducials=None, size=None, templates=None, anchors=None):
+        """
+        @param {Fiducials, default None} fiducials Located fiducials to extract templates from
+        @param {tuple, default None} size The (height, width) of each template. If None, half of
+        each fiducial window is used.
+        @param {list, default None} templates Template images for each fiducial position, used
+        instead of extracting them from fiducials
+        @param {list, default None} anchors The (x, y) position of the fiducial point within each
+        template, used with templates
+        """
+        if fiducials is not None:
+            templates, anchors = self._extract(fiducials, size)
+        elif templates is None or anchors is None:
+            raise ValueError(
+                "A FiducialTemplate must be created from located fiducials or from templates and anchors.")
+
+        self.templates = [None if template is None else np.float32(template)
+                          for template in templates]
+        self.anchors = [None if anchor is None else tuple(anchor)
+                        for anchor in anchors]
+
+        # Cached FFTs of each zero-mean template, keyed by position and padded window shape
+        self._spectra = {}
+
+    def __repr__(self):
+        shapes = [None if template is None else template.shape
+                  for template in self.templates]
+        return f"FiducialTemplate({shapes})"
+
+    def _extract(self, fiducials, size):
+        """
+        Extract a template centered on each located fiducial point, clipped to its window.
+        """
+        templates, anchors = [], []
+
+        for fiducial in fiducials.fiducials:
+            if fiducial is None or fiducial._coordinates is None:
+                templates.append(None)
+                anchors.append(None)
+                continue
+
+            if fiducial.img is None:
+                raise ValueError(
+                    "Templates can't be extracted from fiducials without images, such as fiducials restored from a manifest.")
+
+            height, width = fiducial.img.shape[:2]
+            template_height, template_width = size or (height // 2, width // 2)
+            x, y = (int(round(float(c))) for c in fiducial._coordinates)
+
+            top = int(np.clip(y - template_height // 2, 0, max(height - template_height, 0)))
+            left = int(np.clip(x - template_width // 2, 0, max(width - template_width, 0)))
+
+            templates.append(fiducial.img[top:top + template_height,
+                                          left:left + template_width].copy())
+            anchors.append((x - left, y - top))
+
+        return templates, anchors
+
+    def match(self, fiducials):
+        """
+        Locate a list of fiducials, such as Fiducials.fiducials, by matching them to the template
+        at the same position. Coordinates are stored in each fiducial.
+        @param {list} fiducials The Fiducial at each position
+        @return {list} The normalized cross correlation score of each match, or None for
+        fiducials that couldn't be matched
+        """
+        scores = []
+
+        for position, fiducial in enumerate(fiducials):
+            if fiducial is None:
+                scores.append(None)
+                continue
+
+            fiducial._filtered = None
+            fiducial._coordinates = None
+            scores.append(None)
+
+            if position >= len(self.templates) or self.templates[position] is None:
+                continue
+
+            correlation = self._correlate(position, fiducial.img)
+            if correlation is None:
+                continue
+
+            y, x = np.unravel_index(np.argmax(correlation), correlation.shape)
+            dx, dy = self._refine_peak(correlation, x, y)
+            anchor_x, anchor_y = self.anchors[position]
+
+            fiducial._coordinates = (np.float32(x + dx + anchor_x),
+                                     np.float32(y + dy + anchor_y))
+            scores[position] = float(correlation[y, x])
+
+        return scores
+
+    def _correlate(self, position, img):
+        """
+        Return the normalized cross correlation of a template with every position in an image,
+        matching cv2.matchTemplate with TM_CCOEFF_NORMED. Returns None if the image is smaller
+        than the template.
+        """
+        template = self.templates[position]
+        height, width = img.shape[:2]
+        template_height, template_width = template.shape
+        out_height, out_width = height - template_height + 1, width - template_width + 1
+
+        if out_height < 1 or out_width < 1:
+            return None
+
+        shape = (cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width))
+        spectrum = self._spectrum(position, shape)
+
+        img = np.float32(img)
+        padded = np.zeros(shape, dtype=np.float32)
+        padded[:height, :width] = img
+
+        # Correlating with a zero-mean template removes the local image mean from the numerator
+        product = cv2.mulSpectrums(cv2.dft(padded, flags=cv2.DFT_COMPLEX_OUTPUT), spectrum, 0,
+                                   conjB=True)
+        numerator = cv2.idft(product, flags=cv2.DFT_REAL_OUTPUT | cv2.DFT_SCALE)[
+            :out_height, :out_width]
+
+        # Local sums of the image and its square under the template, from integral images
+        sums, squares = cv2.integral2(img, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        local_sum = self._window_sums(sums, template_height, template_width)
+        local_square = self._window_sums(squares, template_height, template_width)
+        variance = local_square - local_sum ** 2 / template.size
+
+        template_variance = float(((template - template.mean()) ** 2).sum())
+        denominator = np.sqrt(np.maximum(variance, 0) * template_variance)
+
+        # Flat regions have no defined correlation
+        return np.where(denominator > 1e-6, numerator / np.maximum(denominator, 1e-6), 0).astype(np.float32)
+
+    def _spectrum(self, position, shape):
+        """
+        Return the cached FFT of a zero-mean template, padded to a shape
+        """
+        key = (position, shape)
+
+        if key not in self._spectra:
+            template = self.templates[position]
+            padded = np.zeros(shape, dtype=np.float32)
+            padded[:template.shape[0], :template.shape[1]
+                   ] = template - template.mean()
+            self._spectra[key] = cv2.dft(padded, flags=cv2.DFT_COMPLEX_OUTPUT)
+
+        return self._spectra[key]
+
+    def _window_sums(self, integral, height, width):
+        """
+        Return the sum of every height x width window from an integral image
+        """
+        return integral[height:, width:] - integral[:-height, width:] - \
+            integral[height:, :-width] + integral[:-height, :-width]
+
+    def _refine_peak(self, correlation, x, y):
+        """
+        Estimate the sub-pixel offset of a correlation peak by fitting a parabola along each axis
+        """
+        height, width = correlation.shape
+        offsets = []
+
+        for values, index, length in ((correlation[y, x - 1:x + 2], x, width),
+                                      (correlation[y - 1:y + 2, x], y, height)):
+            # Peaks on the edge can't be refined
+            if index == 0 or index == length - 1:
+                offsets.append(0.)
+                continue
+
+            curvature = values[0] - 2 * values[1] + values[2]
+            offsets.append(float(np.clip(0.5 * (values[0] - values[2]) / curvature, -0.5, 0.5))
+                           if curvature < 0 else 0.)
+
+        return offsets
+
+    def save(self, path):
+        """
+        Save the templates to a .npz file so that they can be reused for photos from the same camera
+        """
+        present = [template is not None for template in self.templates]
+        arrays = {f"template_{i}": template for i, template in enumerate(self.templates)
+                  if template is not None}
+        anchors = [anchor if anchor is not None else (0, 0)
+                   for anchor in self.anchors]
+
+        np.savez_compressed(path, present=present, anchors=anchors, **arrays)
+
+    @staticmethod
+    def load(path):
+        """
+        Load templates saved with FiducialTemplate.save
+        """
+        with np.load(path) as data:
+            templates = [data[f"template_{i}"] if present else None
+                         for i, present in enumerate(data["present"])]
+            anchors = [tuple(anchor) if present else None
+                       for anchor, present in zip(data["anchors"], data["present"])]
+
+        return FiducialTemplate(templates=templates, anchors=anchors)
@@ -11,11 +11,16 @@ class Fiducials:
     BOTTOM = 2
     LEFT = 3
 
-    def __init__(self, img):
-        self.img = img
+    def __init__(self, photo):
+        # The photo that contains the fiducials
+        self.photo = photo
 
         self.fiducials = [None for i in range(4)]
 
+    @property
+    def img(self):
+        return self.photo.img
+
     @property
     def top(self):
         return self.fiducials[0]
@@ -32,14 +37,41 @@ class Fiducials:
     def left(self):
         return self.fiducials[3]
 
-    def locate(self, size, kernel_size=None, iterations=4, threshold=False, block_size=999):
+    def locate(self, size, kernel_size=None, iterations=4, threshold=False, block_size=999,
+               template=None, windows=None, subpixel=False, positions=None):
         """
         Extract fiducials from image and store. Filter fiducials and use corner-finding to locate
         exact fiducial positions.
+        @param {FiducialTemplate, default None} template If given, fiducials are located by
+        matching them to templates from a reference photo instead of by filtering and corner
+        finding.
+        @param {list, default None} windows A (top, bottom, left, right) search window for each
+        fiducial position, relative to the top left of its default window. Positions without a
+        window use the default window.
+        @param {bool, default False} subpixel If true, corners are refined to sub-pixel accuracy
+        @param {list, default None} positions The positions of the fiducials to locate, e.g. to
+        retry only fiducials located with low confidence. If None, all fiducials are located.
         """
-        self.fiducials = self._crop_fiducials(size)
+        if positions is None:
+            positions = [self.TOP, self.RIGHT, self.BOTTOM, self.LEFT]
+
+        cropped = self._crop_fiducials(size, windows, positions)
+        self.fiducials = [cropped[position] if position in positions else fiducial
+                          for position, fiducial in enumerate(self.fiducials)]
+
+        if template is not None:
+            scores = template.match(cropped)
+
+            for fiducial, score in zip(cropped, scores):
+                if fiducial is not None:
+                    fiducial.quality["score"] = score
+        else:
+            self._calculate_coordinates(kernel_size, iterations, threshold, block_size, subpixel,
+                                        positions)
 
-        return self._calculate_coordinates(kernel_size, iterations, threshold, block_size)
+        self._score_symmetry()
+
+        return self.coordinates
 
     def preview(self, ax=None, index=None):
         for fiducial in self.fiducials:
@@ -53,17 +85,17 @@ class Fiducials:
         boxes = []
 
         for position in [self.TOP, self.RIGHT, self.BOTTOM, self.LEFT]:
-            bbox = self._get_fiducial_bbox(self.img, position, size)
+            bbox = self._get_fiducial_bbox(self.photo.size, position, size)
             boxes.append(bbox)
 
         return boxes
 
-    def _get_fiducial_bbox(self, img, position, size):
+    def _get_fiducial_bbox(self, shape, position, size):
         """
         Generate a bounding box for a fiducial
         """
-        img_width = img.shape[0]
-        img_height = img.shape[1]
+        img_width = shape[0]
+        img_height = shape[1]
 
         if position in [self.TOP, self.BOTTOM]:
             left = img_width // 2 - size[1] // 2
@@ -94,35 +126,82 @@ class Fiducials:
             [left, bottom]
         ]
 
-        return BoundingBox(np.array(coords), self.img)
+        return BoundingBox(np.array(coords), shape=shape)
 
-    def _crop_fiducials(self, size):
+    def _crop_fiducials(self, size, windows=None, positions=None):
+        """
+        Crop the fiducial windows from the photo. If the photo isn't loaded, only the windows are
+        read from disk where possible. Relative search windows replace the default windows. If
+        positions are given, other positions are None.
+        """
         fiducial_boxes = self.get_fiducial_bboxes(size)
+        height, width = self.photo.size
 
         fiducials = []
-        for box in fiducial_boxes:
+        for position, box in enumerate(fiducial_boxes):
+            if positions is not None and position not in positions:
+                fiducials.append(None)
+                continue
+
             extent = box.extent
-            crop = self.img[extent[0]:extent[1], extent[2]:extent[3]]
+
+            if windows is not None and windows[position] is not None:
+                top, bottom, left, right = windows[position]
+                extent = (int(np.clip(extent[0] + top, 0, height)),
+                          int(np.clip(extent[0] + bottom, 0, height)),
+                          int(np.clip(extent[2] + left, 0, width)),
+                          int(np.clip(extent[2] + right, 0, width)))
+            # Copy the crop so that it doesn't keep the full image in memory
+            crop = self.photo.read_window(*extent).copy()
             # Top-left corner coordinates for the fiducial
             corner = (extent[0], extent[2])
             fiducials.append(Fiducial(crop, corner))
 
         return fiducials
 
-    def _calculate_coordinates(self, kernel_size, iterations, threshold, block_size):
+    def _calculate_coordinates(self, kernel_size, iterations, threshold, block_size, subpixel=False,
+                               positions=None):
         """
         Run image processing and corner finding to locate coordinates of each fiducial corner
         """
         if not kernel_size:
             # This is a good default size
-            kernel_size = self.img.shape[0] // 200
+            kernel_size = self.photo.height // 200
 
-        for fiducial in [self.top, self.right, self.bottom, self.left]:
-            fiducial._calculate_coordinates(kernel_size, iterations,
-                                            threshold, block_size)
+        if positions is None:
+            positions = [self.TOP, self.RIGHT, self.BOTTOM, self.LEFT]
+
+        for position in positions:
+            self.fiducials[position]._calculate_coordinates(kernel_size, iterations, threshold,
+                                                            block_size, subpixel)
 
         return self.coordinates
 
+    def _score_symmetry(self):
+        """
+        Score each fiducial by its distance from the position mirrored from the opposite fiducial
+        through the midpoint of the other two fiducials. Four points only have one such asymmetry,
+        so every fiducial of a photo gets the same score, which flags the photo as a whole. Scores
+        are None if any of the other three fiducials are missing.
+        """
+        coordinates = self.coordinates
+
+        for position, fiducial in enumerate(self.fiducials):
+            if fiducial is None:
+                continue
+
+            opposite = coordinates[(position + 2) % 4]
+            sides = coordinates[(position + 1) % 4], coordinates[(position + 3) % 4]
+
+            if coordinates[position] is None or opposite is None or None in sides:
+                fiducial.quality["symmetry"] = None
+                continue
+
+            center = (np.array(sides[0]) + np.array(sides[1])) / 2
+            expected = 2 * center - np.array(opposite)
+            fiducial.quality["symmetry"] = float(
+                np.linalg.norm(np.array(coordinates[position]) - expected))
+
     @property
     def coordinates(self):
         """
@@ -0,0 +1,191 @@
+import numpy as np
+
+
+class GridIndex:
+    """
+    A uniform grid over box extents. Each grid cell lists the boxes that overlap it, so boxes near a
+    region can be found by checking a few cells instead of every box.
+    """
+
+    # The maximum number of cells along each axis of the grid
+    MAX_CELLS = 1024
+    # The maximum number of cells along each axis of a median sized box
+    MAX_BOX_CELLS = 8
+
+    def __init__(self, extents, cell_size=None):
+        """
+        @param {np.ndarray} extents The (top, bottom, left, right) extent of each box
+        @param {float, default None} cell_size The height and width of each grid cell. If None, twice
+        the median box size is used. Cells are enlarged if needed so that the grid has at most
+        MAX_CELLS cells along each axis and a median box covers at most MAX_BOX_CELLS cells along
+        each axis.
+        """
+        self.extents = np.asarray(extents, dtype=np.float64).reshape(-1, 4)
+
+        sizes = np.maximum(self.extents[:, 1] - self.extents[:, 0],
+                           self.extents[:, 3] - self.extents[:, 2])
+        median_size = float(np.median(sizes)) if len(sizes) else 0.
+
+        if cell_size is None:
+            cell_size = 2 * median_size
+
+        # Tiny cells would create a huge grid and list each box in many cells
+        span = float((self.extents[:, [1, 3]].max(axis=0) - self.extents[:, [0, 2]].min(axis=0)).max()) \
+            if len(self.extents) else 0.
+        self.cell_size = max(float(cell_size), span / self.MAX_CELLS,
+                             median_size / self.MAX_BOX_CELLS, 1.)
+
+        # The top-left corner of the grid
+        self.origin = self.extents[:, [0, 2]].min(
+            axis=0) if len(self.extents) else np.zeros(2)
+
+        rows = self._cells(self.extents[:, [0, 1]], self.origin[0])
+        cols = self._cells(self.extents[:, [2, 3]], self.origin[1])
+        self.n_rows = rows.max() + 1 if len(rows) else 1
+        self.n_cols = cols.max() + 1 if len(cols) else 1
+
+        # List every (box, cell) pair that overlaps
+        row_counts = rows[:, 1] - rows[:, 0] + 1
+        col_counts = cols[:, 1] - cols[:, 0] + 1
+        counts = row_counts * col_counts
+
+        boxes = np.repeat(np.arange(len(counts)), counts)
+        within = np.arange(counts.sum()) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+        cell_rows = rows[boxes, 0] + within // col_counts[boxes]
+        cell_cols = cols[boxes, 0] + within % col_counts[boxes]
+        cells = cell_rows * self.n_cols + cell_cols
+
+        # Sort the pairs by cell so that each cell's boxes are contiguous
+        order = np.argsort(cells, kind="stable")
+        self._cell_boxes = boxes[order]
+        self._cell_starts = np.searchsorted(
+            cells[order], np.arange(self.n_rows * self.n_cols + 1))
+
+    def __len__(self):
+        return len(self.extents)
+
+    def _cells(self, bounds, origin):
+        """
+        Convert pairs of coordinate bounds along one axis to the grid cells they fall in.
+        """
+        return np.floor((bounds - origin) / self.cell_size).astype(np.int64)
+
+    def _candidates(self, row_range, col_range):
+        """
+        Return the unique boxes overlapping a range of cells.
+        """
+        row0, row1 = max(row_range[0], 0), min(row_range[1], self.n_rows - 1)
+        col0, col1 = max(col_range[0], 0), min(col_range[1], self.n_cols - 1)
+
+        if row0 > row1 or col0 > col1:
+            return np.empty(0, dtype=np.int64)
+
+        # Consecutive cells within a grid row are stored contiguously
+        segments = [self._cell_boxes[self._cell_starts[row * self.n_cols + col0]:
+                                     self._cell_starts[row * self.n_cols + col1 + 1]]
+                    for row in range(row0, row1 + 1)]
+
+        return np.unique(np.concatenate(segments))
+
+    def query(self, extent):
+        """
+        Return the indices of boxes whose extents intersect or touch an extent.
+        @param {tuple} extent The (top, bottom, left, right) extent to search
+        @return {np.ndarray} The sorted indices of intersecting boxes
+        """
+        top, bottom, left, right = extent
+
+        rows = self._cells(np.array([top, bottom]), self.origin[0])
+        cols = self._cells(np.array([left, right]), self.origin[1])
+        candidates = self._candidates(rows, cols)
+
+        boxes = self.extents[candidates]
+        intersects = (boxes[:, 0] <= bottom) & (boxes[:, 1] >= top) & \
+            (boxes[:, 2] <= right) & (boxes[:, 3] >= left)
+
+        return candidates[intersects]
+
+    def intersecting_pairs(self):
+        """
+        Return every pair of boxes whose extents intersect or touch. Only boxes that share a grid
+        cell are compared, so boxes spread along a row or column aren't compared with every other
+        box in it.
+        @return {tuple} The first and second box of each pair, with the lower index first
+        """
+        # Pair each box listed in a cell with the boxes listed after it in the same cell
+        ends = np.repeat(self._cell_starts[1:], np.diff(self._cell_starts))
+        counts = ends - np.arange(len(self._cell_boxes)) - 1
+        first = np.repeat(np.arange(len(counts)), counts)
+        second = first + 1 + np.arange(counts.sum()) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+        first, second = self._cell_boxes[first], self._cell_boxes[second]
+
+        a, b = self.extents[first], self.extents[second]
+        intersects = (a[:, 0] <= b[:, 1]) & (a[:, 1] >= b[:, 0]) & \
+            (a[:, 2] <= b[:, 3]) & (a[:, 3] >= b[:, 2])
+
+        # Boxes that share several cells are paired in each of them
+        pairs = np.unique(np.minimum(first, second)[intersects] * len(self) +
+                          np.maximum(first, second)[intersects])
+
+        return pairs // len(self), pairs % len(self)
+
+    def distances(self, point, indices=None):
+        """
+        Return the distance from a point to the extent of each box. Points inside an extent have a
+        distance of zero.
+        @param {tuple} point The (x, y) point to measure from
+        @param {np.ndarray, default None} indices The boxes to measure. If None, all boxes are measured.
+        """
+        x, y = point
+        boxes = self.extents if indices is None else self.extents[indices]
+
+        dx = np.maximum.reduce((boxes[:, 2] - x, np.zeros(len(boxes)), x - boxes[:, 3]))
+        dy = np.maximum.reduce((boxes[:, 0] - y, np.zeros(len(boxes)), y - boxes[:, 1]))
+
+        return np.hypot(dx, dy)
+
+    def nearest(self, point, k=1):
+        """
+        Return the indices of the k boxes nearest to a point, measured to their extents. The search
+        expands in rings of doubling size around the grid cell nearest the point, until no
+        unsearched box can be nearer or the whole grid has been searched.
+        @param {tuple} point The (x, y) point to search from
+        @param {int, default 1} k The number of boxes to return
+        @return {np.ndarray} The indices of the nearest boxes, nearest first
+        """
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0, dtype=np.int64)
+
+        x, y = point
+        # Points outside of the grid start from the nearest cell within it
+        row = int(np.clip(self._cells(np.array(y), self.origin[0]), 0, self.n_rows - 1))
+        col = int(np.clip(self._cells(np.array(x), self.origin[1]), 0, self.n_cols - 1))
+
+        ring = 0
+        while True:
+            row0, row1 = max(row - ring, 0), min(row + ring, self.n_rows - 1)
+            col0, col1 = max(col - ring, 0), min(col + ring, self.n_cols - 1)
+            candidates = self._candidates((row0, row1), (col0, col1))
+
+            if len(candidates) >= k:
+                distances = self.distances(point, candidates)
+                nearest = np.argsort(distances, kind="stable")[:k]
+
+                # Unsearched boxes lie beyond a side of the searched cells that isn't the edge
+                # of the grid, so they are at least as far as the nearest such side
+                top = self.origin[0] + row0 * self.cell_size
+                bottom = self.origin[0] + (row1 + 1) * self.cell_size
+                left = self.origin[1] + col0 * self.cell_size
+                right = self.origin[1] + (col1 + 1) * self.cell_size
+                searched = min([np.inf] + [distance for distance, edge in
+                                           ((y - top, row0 == 0), (bottom - y, row1 == self.n_rows - 1),
+                                            (x - left, col0 == 0), (right - x, col1 == self.n_cols - 1))
+                                           if not edge])
+
+                if distances[nearest[-1]] <= searched:
+                    return candidates[nearest]
+
+            ring = 2 * ring if ring else 1
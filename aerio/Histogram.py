@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+
+class Histogram:
+    """
+    The cumulative distribution of an image's values. Computing this once for a reference image
+    allows any number of images to be histogram matched to it without re-reading the reference.
+    """
+
+    def __init__(self, img):
+        values, counts = self._count(img)
+
+        # Omit values that don't occur in the image
+        present = counts > 0
+        self.values = values[present]
+        self.quantiles = np.cumsum(counts[present]) / img.size
+
+    def __repr__(self):
+        return f"Histogram({len(self.values)} values)"
+
+    def _count(self, img):
+        """
+        Return the unique values in an image and the number of times each occurs. Unsigned integer
+        images are counted over every possible value from 0 to the image maximum.
+        """
+        if img.dtype.kind == "u":
+            counts = np.bincount(img.ravel())
+            return np.arange(len(counts)), counts
+
+        return np.unique(img.ravel(), return_counts=True)
+
+    def match(self, img, dtype=None):
+        """
+        Match the histogram of an image to this histogram. Unsigned integer images are matched with
+        a lookup table in a single pass over the image.
+        @param {np.ndarray} img The image to match
+        @param {type, default None} dtype The output data type. If None, the image data type is used.
+        @return {np.ndarray} The matched image
+        """
+        dtype = dtype or img.dtype
+
+        if img.dtype.kind == "u":
+            counts = np.bincount(
+                img.ravel(), minlength=np.iinfo(img.dtype).max + 1)
+            src_quantiles = np.cumsum(counts) / img.size
+            lut = np.interp(src_quantiles, self.quantiles,
+                            self.values).astype(dtype)
+
+            if img.dtype == np.uint8 and lut.dtype == np.uint8:
+                return cv2.LUT(img, lut)
+
+            return lut.take(img)
+
+        src_values, src_lookup, src_counts = np.unique(
+            img.ravel(), return_inverse=True, return_counts=True)
+        src_quantiles = np.cumsum(src_counts) / img.size
+        lut = np.interp(src_quantiles, self.quantiles,
+                        self.values).astype(dtype)
+
+        return lut[src_lookup].reshape(img.shape)
@@ -0,0 +1,165 @@
+import numpy as np
+
+
+class InteriorOrientation:
+    """
+    Affine or projective transforms from the fiducial coordinates of each photo to calibrated
+    fiducial coordinates, solved for every photo at once. The least squares problems of all photos
+    are stacked into one array of design matrices and solved together, so large collections are
+    oriented without looping over photos. Fiducials that weren't located are given zero weight, and
+    photos without enough fiducials to solve their transform get NaN transforms.
+    """
+
+    AFFINE = "affine"
+    PROJECTIVE = "projective"
+
+    # The minimum number of fiducials needed to solve each model
+    MIN_POINTS = {AFFINE: 3, PROJECTIVE: 4}
+
+    def __init__(self, coordinates, calibrated, model=AFFINE):
+        """
+        @param {np.ndarray} coordinates An (n photos, k fiducials, 2) array of (x, y) fiducial
+        coordinates in each photo, with NaN for fiducials that weren't located
+        @param {np.ndarray} calibrated A (k, 2) array of the calibrated (x, y) position of each
+        fiducial, or an (n, k, 2) array with different positions for each photo
+        @param {str, default "affine"} model The transform to solve: "affine" or "projective"
+        """
+        if model not in self.MIN_POINTS:
+            raise ValueError(
+                f"Interior orientation model must be \"{self.AFFINE}\" or \"{self.PROJECTIVE}\", not \"{model}\".")
+
+        coordinates = np.asarray(coordinates, dtype=np.float64)
+        if coordinates.ndim != 3 or coordinates.shape[2] != 2:
+            raise ValueError(
+                f"Fiducial coordinates must have shape (photos, fiducials, 2), not {coordinates.shape}.")
+
+        calibrated = np.broadcast_to(
+            np.asarray(calibrated, dtype=np.float64), coordinates.shape)
+
+        self.model = model
+        self.coordinates = coordinates
+        self.calibrated = calibrated
+
+        # Transforms from photo coordinates to calibrated coordinates, as 3x3 matrices
+        self.transforms = self._solve(coordinates, calibrated)
+        # The calibrated position of each fiducial minus its transformed position
+        self.residuals = calibrated - self.apply(coordinates)
+        # The root mean square residual distance of each photo's located fiducials
+        squared = (self.residuals ** 2).sum(axis=2)
+        count = np.isfinite(squared).sum(axis=1)
+        self.rmse = np.where(count > 0, np.sqrt(np.nansum(squared, axis=1) / np.maximum(count, 1)),
+                             np.nan)
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def __repr__(self):
+        return f"InteriorOrientation({len(self)} photos, {self.model})"
+
+    @property
+    def solved(self):
+        """
+        Return whether each photo's transform could be solved
+        """
+        return np.isfinite(self.transforms).all(axis=(1, 2))
+
+    @property
+    def inverse(self):
+        """
+        Return the transforms from calibrated coordinates to photo coordinates
+        """
+        inverse = np.full_like(self.transforms, np.nan)
+        inverse[self.solved] = np.linalg.inv(self.transforms[self.solved])
+
+        return inverse
+
+    def apply(self, points, transforms=None):
+        """
+        Transform points in each photo to calibrated coordinates
+        @param {np.ndarray} points A (m, 2) array of (x, y) points to transform with every photo's
+        transform, or an (n, m, 2) array of different points for each photo
+        @param {np.ndarray, default None} transforms The (n, 3, 3) transforms to apply. If None,
+        the solved transforms are used.
+        @return {np.ndarray} An (n, m, 2) array of transformed points
+        """
+        if transforms is None:
+            transforms = self.transforms
+
+        points = np.broadcast_to(np.asarray(points, dtype=np.float64),
+                                 (len(transforms),) + np.shape(points)[-2:])
+        homogeneous = np.concatenate(
+            (points, np.ones(points.shape[:2] + (1,))), axis=2)
+        transformed = homogeneous @ np.swapaxes(transforms, 1, 2)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return transformed[..., :2] / transformed[..., 2:]
+
+    def _solve(self, coordinates, calibrated):
+        """
+        Solve the transform of every photo by weighted linear least squares. Both sets of points
+        are first normalized to be centered on the origin with unit mean distance, which keeps the
+        projective problem well conditioned.
+        """
+        n, k = coordinates.shape[:2]
+        located = np.isfinite(coordinates).all(axis=2) & np.isfinite(calibrated).all(axis=2)
+
+        source, source_norm = self._normalize(coordinates, located)
+        target, target_norm = self._normalize(calibrated, located)
+
+        x, y = source[..., 0], source[..., 1]
+        u, v = target[..., 0], target[..., 1]
+        zeros, ones = np.zeros((n, k)), np.ones((n, k))
+
+        # Each fiducial contributes an equation for its x and one for its y coordinate
+        if self.model == self.AFFINE:
+            x_rows = np.stack((x, y, ones, zeros, zeros, zeros), axis=2)
+            y_rows = np.stack((zeros, zeros, zeros, x, y, ones), axis=2)
+        else:
+            x_rows = np.stack((x, y, ones, zeros, zeros,
+                               zeros, -u * x, -u * y), axis=2)
+            y_rows = np.stack((zeros, zeros, zeros, x, y,
+                               ones, -v * x, -v * y), axis=2)
+
+        # Fiducials that weren't located are removed by zeroing their equations
+        weights = np.concatenate((located, located), axis=1)[..., np.newaxis]
+        design = np.concatenate((x_rows, y_rows), axis=1) * weights
+        observed = np.concatenate((u, v), axis=1)[..., np.newaxis] * weights
+
+        parameters = (np.linalg.pinv(design) @ observed)[..., 0]
+
+        transforms = np.zeros((n, 3, 3))
+        transforms.reshape(n, 9)[:, :parameters.shape[1]] = parameters
+        transforms[:, 2, 2] = 1
+
+        # Undo the normalization
+        transforms = np.linalg.inv(target_norm) @ transforms @ source_norm
+        with np.errstate(divide="ignore", invalid="ignore"):
+            transforms /= transforms[:, 2:, 2:]
+
+        transforms[located.sum(axis=1) < self.MIN_POINTS[self.model]] = np.nan
+
+        return transforms
+
+    def _normalize(self, points, located):
+        """
+        Translate and scale each photo's located points so that they are centered on the origin
+        with a mean distance of one. Returns the normalized points, with points that weren't
+        located set to zero, and the (n, 3, 3) normalizing transforms.
+        """
+        count = np.maximum(located.sum(axis=1), 1)[:, np.newaxis]
+        points = np.where(located[..., np.newaxis], points, 0)
+
+        center = points.sum(axis=1) / count
+        distance = np.where(located, np.linalg.norm(
+            points - center[:, np.newaxis], axis=2), 0)
+        mean_distance = distance.sum(axis=1) / count[:, 0]
+        scale = np.where(mean_distance > 0, 1 / np.maximum(mean_distance, 1e-12), 1)
+
+        transforms = np.zeros((len(points), 3, 3))
+        transforms[:, 0, 0] = transforms[:, 1, 1] = scale
+        transforms[:, :2, 2] = -center * scale[:, np.newaxis]
+        transforms[:, 2, 2] = 1
+
+        normalized = (points - center[:, np.newaxis]) * scale[:, np.newaxis, np.newaxis]
+
+        return np.where(located[..., np.newaxis], normalized, 0), transforms
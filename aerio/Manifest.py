@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+from aerio import utils
+
+
+class Manifest:
+    """
+    A record of the photos that a run has finished, so that an interrupted run can be resumed.
+    Each finished photo is appended to the manifest file as a line of JSON and flushed to disk
+    immediately, so the manifest is never rewritten and a crash can at most lose the line being
+    written. A photo is only skipped if its record has the same signature as the current run and
+    its output file still exists with the recorded size.
+    """
+
+    def __init__(self, path):
+        """
+        @param {str} path The manifest file. It is created if it doesn't exist.
+        """
+        self.path = path
+
+        # The latest record of each photo, keyed by source path
+        self.records = self._read()
+
+    def __repr__(self):
+        return f"Manifest(\"{self.path}\", {len(self.records)} photos)"
+
+    def __len__(self):
+        return len(self.records)
+
+    def _read(self):
+        """
+        Read the records in the manifest file. Incomplete or invalid lines are ignored.
+        """
+        records = {}
+
+        if not os.path.exists(self.path):
+            return records
+
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                if isinstance(record, dict) and "source" in record:
+                    records[record["source"]] = record
+
+        return records
+
+    def signature(self, photo, *params):
+        """
+        Return a signature of a photo's current image and the parameters of a run. Images that
+        haven't been modified are identified by their source file's modification time and size
+        and any lazy crops. Modified images are hashed directly.
+        @param {Photo} photo The photo
+        @param params Every parameter that affects the output
+        @return {str} The signature
+        """
+        digest = hashlib.md5()
+
+        if photo.is_loaded and photo._modified:
+            utils.update_hash(digest, photo.img)
+        else:
+            stat = os.stat(photo.path)
+            utils.update_hash(digest, (stat.st_mtime_ns, stat.st_size, photo._crop_windows,
+                                       np.dtype(photo.dtype).name))
+
+        utils.update_hash(digest, params)
+
+        return digest.hexdigest()
+
+    def get(self, photo, signature):
+        """
+        Return the record of a photo if it was finished with the same signature and its output is
+        intact, or None otherwise
+        """
+        record = self.records.get(self._source(photo))
+
+        if record is None or record["signature"] != signature:
+            return None
+
+        output = record["output"]
+        if not os.path.exists(output) or os.path.getsize(output) != record["size"]:
+            return None
+
+        return record
+
+    def complete(self, photo, signature, output, **data):
+        """
+        Record that a photo is finished
+        @param {Photo} photo The photo
+        @param {str} signature The signature of the photo and run
+        @param {str} output The path of the photo's output file
+        @param data Other JSON serializable results to record, such as fiducial coordinates
+        @return {dict} The record
+        """
+        record = dict(data, source=self._source(photo), signature=signature, output=output,
+                      size=os.path.getsize(output))
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.path, "a+b") as f:
+            # A line cut off by a crash is ended so that it doesn't corrupt the new record
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+            f.write((json.dumps(record) + "\n").encode())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.records[record["source"]] = record
+
+        return record
+
+    def _source(self, photo):
+        return os.path.abspath(photo.path)
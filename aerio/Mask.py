@@ -0,0 +1,387 @@
+import cv2
+import numpy as np
+
+
+# The number of set bits in every possible byte
+BIT_COUNTS = np.unpackbits(
+    np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).sum(axis=1)
+
+
+class Mask:
+    """
+    A binary photo mask stored in a compact form. A mask can be stored as the polygons that
+    define it, as a packed bitmap with one bit per pixel, or as run lengths of alternating
+    background and foreground pixels. Other forms are computed from the available form when they
+    are first needed, and a dense array is only created on request.
+    """
+
+    POLYGONS = "polygons"
+    PACKED = "packed"
+    RLE = "rle"
+
+    # The number of pixels filled at a time from packed and run length masks
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, shape, polygons=None, packed=None, runs=None):
+        """
+        @param {tuple} shape The (height, width) of the mask
+        @param {list, default None} polygons A list of (x, y) coordinate arrays to fill as foreground
+        @param {np.ndarray, default None} packed The mask flattened in row order and packed with
+        np.packbits
+        @param {np.ndarray, default None} runs The lengths of alternating background and foreground
+        runs of the mask flattened in row order, starting with a background run
+        """
+        if polygons is None and packed is None and runs is None:
+            raise ValueError(
+                "A Mask must be created from polygons, a packed bitmap, or run lengths.")
+
+        self.shape = tuple(int(x) for x in shape)
+        self._polygons = polygons
+        self._packed = packed
+        self._runs = runs
+
+    def __repr__(self):
+        forms = [name for name, form in ((self.POLYGONS, self._polygons), (self.PACKED, self._packed),
+                                         (self.RLE, self._runs)) if form is not None]
+        return f"Mask({self.shape[0]}x{self.shape[1]}, {', '.join(forms)})"
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def polygons(self):
+        return self._polygons
+
+    @property
+    def packed(self):
+        """
+        Return the mask as a packed bitmap
+        """
+        if self._packed is None:
+            self._packed = np.packbits(self._to_bool())
+
+        return self._packed
+
+    @property
+    def runs(self):
+        """
+        Return the mask as alternating background and foreground run lengths
+        """
+        if self._runs is None:
+            if self._packed is None:
+                starts, ends = self._rasterize_intervals()
+            else:
+                starts, ends = self._bool_to_intervals(self._to_bool())
+
+            self._runs = self._intervals_to_runs(starts, ends)
+
+        return self._runs
+
+    def _stored(self):
+        """
+        Return the shape and the form the mask is stored in, without computing any other form
+        """
+        for name, form in ((self.POLYGONS, self._polygons), (self.PACKED, self._packed),
+                           (self.RLE, self._runs)):
+            if form is not None:
+                return (self.shape, name, form)
+
+    @property
+    def area(self):
+        """
+        Return the number of foreground pixels
+        """
+        if self._packed is not None:
+            return int(BIT_COUNTS[self._packed].sum())
+
+        return int(self.runs[1::2].sum())
+
+    def to_dense(self, bg=255, fg=0, dtype=np.uint8):
+        """
+        Convert the mask to a 2D array
+        """
+        if self._packed is None and self._runs is None:
+            # Polygons can be filled directly without an intermediate form
+            array = np.full(self.shape, fill_value=bg, dtype=dtype)
+
+            for coords in self._polygons:
+                cv2.fillPoly(array, pts=[np.asarray(coords, dtype=np.int32)], color=fg,
+                             lineType=None)
+
+            return array
+
+        return np.where(self._to_bool(), fg, bg).astype(dtype).reshape(self.shape)
+
+    def fill(self, array, value=0):
+        """
+        Set the foreground pixels of the mask in an existing array, in place
+        @param {np.ndarray} array A C-contiguous array with the same height and width as the mask
+        @param {int, default 0} value The value to fill
+        """
+        if array.shape[:2] != self.shape:
+            raise ValueError(
+                f"Array shape {array.shape[:2]} doesn't match mask shape {self.shape}.")
+        if not array.flags.c_contiguous:
+            raise ValueError("Masks can only be filled into C-contiguous arrays.")
+
+        if self._packed is None and self._runs is None:
+            for coords in self._polygons:
+                cv2.fillPoly(array, pts=[np.asarray(coords, dtype=np.int32)], color=value,
+                             lineType=None)
+            return array
+
+        flat = array.reshape(self.size, -1)
+
+        if self._packed is not None:
+            self._fill_packed(flat, value)
+        else:
+            self._fill_intervals(flat, *self._runs_to_intervals(self._runs), value)
+
+        return array
+
+    def _fill_packed(self, flat, value):
+        """
+        Fill the foreground of a packed bitmap into a flattened array, unpacking a block of rows
+        at a time so that a full frame mask is never created
+        """
+        width = self.shape[1]
+        rows = max(self.CHUNK_SIZE // max(width, 1), 1)
+
+        for top in range(0, self.shape[0], rows):
+            start, end = top * width, min(top + rows, self.shape[0]) * width
+            first = start // 8
+            bits = np.unpackbits(self._packed[first:-(-end // 8)])[
+                start - first * 8:end - first * 8]
+            flat[start:end][bits.view(bool)] = value
+
+    def _fill_intervals(self, flat, starts, ends, value):
+        """
+        Fill [start, end) intervals of a flattened array. Intervals longer than CHUNK_SIZE are
+        filled as slices, and shorter intervals are filled in groups covering about CHUNK_SIZE
+        pixels, with the indices of each group built in one operation.
+        """
+        lengths = ends - starts
+
+        long = lengths > self.CHUNK_SIZE
+        for start, end in zip(starts[long], ends[long]):
+            flat[start:end] = value
+
+        starts, ends, lengths = starts[~long], ends[~long], lengths[~long]
+        if not len(lengths):
+            return
+
+        # Group intervals by the chunk that their first pixel falls in, counting only the pixels of
+        # short intervals, so that no group covers more than twice CHUNK_SIZE pixels
+        offsets = np.cumsum(lengths) - lengths
+        splits = np.flatnonzero(np.diff(offsets // self.CHUNK_SIZE)) + 1
+
+        for group in np.split(np.arange(len(lengths)), splits):
+            if len(group) == 1:
+                flat[starts[group[0]]:ends[group[0]]] = value
+                continue
+
+            group_lengths = lengths[group]
+            # The index of each pixel is its interval's start plus its position within the interval
+            within = np.arange(group_lengths.sum()) - np.repeat(
+                np.cumsum(group_lengths) - group_lengths, group_lengths)
+            flat[np.repeat(starts[group], group_lengths) + within] = value
+
+    def __or__(self, other):
+        """
+        Return the union of two masks
+        """
+        return self._combine(other, np.bitwise_or, self._union)
+
+    def __and__(self, other):
+        """
+        Return the intersection of two masks
+        """
+        return self._combine(other, np.bitwise_and, self._intersection)
+
+    def _combine(self, other, bitwise, combine_intervals):
+        """
+        Combine two masks, using their packed bitmaps if either mask has one, or their run
+        lengths otherwise.
+        """
+        if not isinstance(other, Mask):
+            raise ValueError("A Mask can only be combined with another Mask.")
+        if self.shape != other.shape:
+            raise ValueError("To combine two Masks, they must have the same shape.")
+
+        if self._packed is not None or other._packed is not None:
+            return Mask(self.shape, packed=bitwise(self.packed, other.packed))
+
+        starts, ends = combine_intervals(self._runs_to_intervals(self.runs),
+                                         self._runs_to_intervals(other.runs))
+
+        return Mask(self.shape, runs=self._intervals_to_runs(starts, ends))
+
+    def save(self, path, form=RLE):
+        """
+        Save the mask to a compressed .npz file
+        @param {str} path The file path
+        @param {str, default "rle"} form The form to store: "polygons", "packed", or "rle"
+        """
+        if form == self.POLYGONS:
+            if self._polygons is None:
+                raise ValueError(
+                    "Only masks created from polygons can be saved as polygons.")
+
+            polygons = [np.reshape(coords, (-1, 2)) for coords in self._polygons]
+            offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(coords) for coords in polygons])
+            coords = np.concatenate(polygons) if polygons else np.empty(
+                (0, 2), dtype=np.int32)
+
+            np.savez_compressed(path, shape=self.shape, form=form,
+                                coords=coords, offsets=offsets)
+        elif form == self.PACKED:
+            np.savez_compressed(path, shape=self.shape,
+                                form=form, packed=self.packed)
+        elif form == self.RLE:
+            np.savez_compressed(path, shape=self.shape,
+                                form=form, runs=self.runs)
+        else:
+            raise ValueError(
+                f"Mask form must be one of {[self.POLYGONS, self.PACKED, self.RLE]}, not {form}.")
+
+    @staticmethod
+    def load(path):
+        """
+        Load a mask saved with Mask.save
+        """
+        with np.load(path) as data:
+            form = str(data["form"])
+
+            if form == Mask.POLYGONS:
+                coords, offsets = data["coords"], data["offsets"]
+                polygons = [coords[start:end]
+                            for start, end in zip(offsets[:-1], offsets[1:])]
+
+                return Mask(data["shape"], polygons=polygons)
+            if form == Mask.PACKED:
+                return Mask(data["shape"], packed=data["packed"])
+
+            return Mask(data["shape"], runs=data["runs"])
+
+    @staticmethod
+    def from_array(array, fg=0):
+        """
+        Create a mask from a 2D array. Pixels equal to the foreground value become the mask.
+        """
+        array = np.asarray(array)
+
+        return Mask(array.shape, packed=np.packbits(array.ravel() == fg))
+
+    def _to_bool(self):
+        """
+        Return the mask as a flat boolean array
+        """
+        if self._packed is not None:
+            return np.unpackbits(self._packed, count=self.size).astype(bool)
+
+        runs = self.runs
+        return np.repeat(np.arange(len(runs)) % 2 == 1, runs)
+
+    def _rasterize_intervals(self):
+        """
+        Fill the polygons within the region they cover and return the flat [start, end) intervals
+        of foreground pixels, so that sparse masks never allocate a full frame.
+        """
+        polygons = [np.asarray(coords, dtype=np.int32).reshape(-1, 2)
+                    for coords in self._polygons]
+        polygons = [coords for coords in polygons if len(coords)]
+        height, width = self.shape
+
+        if not polygons:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        points = np.concatenate(polygons)
+        left, top = np.clip(points.min(axis=0), 0, (width, height))
+        right, bottom = np.clip(points.max(axis=0) + 1, (left, top), (width, height))
+
+        # Polygons that lie entirely outside of the mask leave it empty
+        if bottom <= top or right <= left:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        region = np.zeros((bottom - top, right - left), dtype=np.uint8)
+        for coords in polygons:
+            cv2.fillPoly(region, pts=[coords], color=1,
+                         lineType=None, offset=(-int(left), -int(top)))
+
+        # Find where each row of the region switches between background and foreground
+        edges = np.diff(np.pad(region, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+        start_rows, start_cols = np.nonzero(edges == 1)
+        end_rows, end_cols = np.nonzero(edges == -1)
+
+        starts = (start_rows + top).astype(np.int64) * width + start_cols + left
+        ends = (end_rows + top).astype(np.int64) * width + end_cols + left
+
+        # Runs that continue from the end of one row to the start of the next are joined
+        return self._union((starts, ends), (np.empty(0, dtype=np.int64),) * 2)
+
+    def _bool_to_intervals(self, flat):
+        """
+        Return the [start, end) intervals of foreground pixels in a flat boolean array
+        """
+        edges = np.diff(flat.astype(np.int8), prepend=0, append=0)
+
+        return np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0]
+
+    def _runs_to_intervals(self, runs):
+        """
+        Convert alternating run lengths to the [start, end) intervals of foreground runs
+        """
+        ends = np.cumsum(runs)
+        starts = ends - runs
+
+        return starts[1::2], ends[1::2]
+
+    def _intervals_to_runs(self, starts, ends):
+        """
+        Convert sorted, disjoint [start, end) foreground intervals to alternating run lengths
+        """
+        bounds = np.empty(2 * len(starts) + 2, dtype=np.int64)
+        bounds[0] = 0
+        bounds[1:-1:2] = starts
+        bounds[2:-1:2] = ends
+        bounds[-1] = self.size
+
+        return np.diff(bounds)
+
+    def _union(self, intervals, other):
+        """
+        Return the union of two sets of [start, end) intervals as sorted, disjoint intervals
+        """
+        starts = np.concatenate((intervals[0], other[0]))
+        ends = np.concatenate((intervals[1], other[1]))
+
+        if not len(starts):
+            return starts, ends
+
+        order = np.argsort(starts, kind="stable")
+        starts, ends = starts[order], ends[order]
+        reach = np.maximum.accumulate(ends)
+
+        # A new interval begins wherever a start is past every previous end
+        new = starts[1:] > reach[:-1]
+
+        return starts[np.r_[True, new]], reach[np.r_[new, True]]
+
+    def _intersection(self, intervals, other):
+        """
+        Return the intersection of two sets of sorted, disjoint [start, end) intervals
+        """
+        positions = np.concatenate(
+            (intervals[0], intervals[1], other[0], other[1]))
+        changes = np.concatenate((np.ones(len(intervals[0])), -np.ones(len(intervals[1])),
+                                  np.ones(len(other[0])), -np.ones(len(other[1]))))
+
+        # Ends are applied before starts at the same position, so touching intervals don't overlap
+        order = np.lexsort((changes, positions))
+        positions, coverage = positions[order], np.cumsum(changes[order])
+
+        overlapping = np.nonzero(coverage == 2)[0]
+
+        return positions[overlapping], positions[overlapping + 1]
@@ -1,28 +1,296 @@
 import copy
 import cv2
+import hashlib
 import matplotlib.pyplot as plt
 import os
 import numpy as np
 import statistics
-from skimage.exposure import match_histograms
+import struct
 
 from aerio.BoundingBoxCollection import BoundingBoxCollection
 from aerio.Fiducials import Fiducials
+from aerio.Histogram import Histogram
 from aerio import utils
 
 
+# TIFF tag codes used to read image metadata from file headers
+TIFF_IMAGE_WIDTH = 256
+TIFF_IMAGE_LENGTH = 257
+TIFF_X_RESOLUTION = 282
+TIFF_Y_RESOLUTION = 283
+TIFF_RESOLUTION_UNIT = 296
+
+# TIFF resolution units
+TIFF_UNIT_NONE = 1
+TIFF_UNIT_CENTIMETER = 3
+
+
 # TODO: Allow directly loading cv2.imread images
 class Photo:
-    def __init__(self, path, dpi=None, photo_size=None, pixel_size=None, dtype=np.uint8):
+    def __init__(self, path, dpi=None, photo_size=None, pixel_size=None, dtype=np.uint8, lazy=False,
+                 dpi_from_header=False, memmap_dir=None, pyramid_dir=None):
+        """
+        @param {str, default None} memmap_dir If given, the image is decoded once into an
+        uncompressed cache file in this directory and memory-mapped from there, so that
+        operations only read the parts of the image they use.
+        @param {str, default None} pyramid_dir If given, reduced resolution levels of the
+        unmodified image are saved in this directory and reused by later sessions.
+        """
         self.path = path
-        self.img = dtype(cv2.imread(self.path, cv2.IMREAD_GRAYSCALE))
         self.dtype = dtype
+        self.memmap_dir = memmap_dir
+        self.pyramid_dir = pyramid_dir
+
+        # The decoded image. If lazy, this is not read until the image is first accessed.
+        self._img = None
+        # True if the image has been changed since it was read
+        self._modified = False
+        self._header = None
+        # Crops that are applied each time the image is read, as (height, width, fill)
+        self._crop_windows = []
+        # Reduced resolution levels of the image, keyed by level
+        self._levels = {}
 
         self._dpi = dpi
         self._photo_size = photo_size
         self._pixel_size = pixel_size
 
-        self._fiducials = Fiducials(self.img)
+        self._fiducials = Fiducials(self)
+
+        # Use the scanning resolution recorded in the file if none is given
+        if dpi_from_header and not any((dpi, photo_size, pixel_size)) and self.header_dpi:
+            self._dpi = statistics.mean(self.header_dpi)
+
+        if not lazy:
+            self._img = self._read()
+
+    def __getstate__(self):
+        """
+        Memory-mapped images that haven't been modified are re-opened from the cache rather than
+        being copied when the photo is pickled, e.g. when it is sent to a worker process.
+        """
+        state = self.__dict__.copy()
+
+        if isinstance(self._img, np.memmap) and not self._modified:
+            state["_img"] = None
+
+        # Pyramid levels are rebuilt when they are needed
+        state["_levels"] = {}
+
+        return state
+
+    @property
+    def img(self):
+        """
+        Return the image array, reading it from disk if it has not been loaded.
+        """
+        if self._img is None:
+            self._img = self._read()
+            self._modified = False
+
+        return self._img
+
+    @img.setter
+    def img(self, img):
+        self._img = img
+        self._modified = True
+        # A new dict is used so that shallow copies of the photo keep their levels
+        self._levels = {}
+
+    def level(self, n):
+        """
+        Return the image reduced by a factor of 2 ** n, built by repeatedly applying cv2.pyrDown.
+        Levels are cached until the image is changed through the img property or cropped. Changes
+        made to the image array in place are not detected.
+        @param {int} n The pyramid level, where 0 is the full resolution image
+        @return {np.ndarray} The reduced image
+        """
+        if n < 0:
+            raise ValueError(f"Pyramid level must be 0 or greater, not {n}.")
+        if n == 0:
+            return self.img
+
+        if n not in self._levels:
+            level_path = self.level_path(n)
+
+            if level_path and os.path.exists(level_path) and \
+                    os.path.getmtime(level_path) >= os.path.getmtime(self.path):
+                self._levels[n] = np.load(level_path)
+            else:
+                self._levels[n] = cv2.pyrDown(self.level(n - 1))
+
+                if level_path:
+                    os.makedirs(self.pyramid_dir, exist_ok=True)
+
+                    # Write to a temporary file first so that a partial level is never read
+                    temp_path = f"{level_path}.{os.getpid()}.tmp"
+                    with open(temp_path, "wb") as f:
+                        np.save(f, self._levels[n])
+                    os.replace(temp_path, level_path)
+
+        return self._levels[n]
+
+    def level_path(self, n):
+        """
+        Return the path that a pyramid level is saved to, or None if levels aren't saved or the
+        image has been modified.
+        """
+        if not self.pyramid_dir or self._modified:
+            return None
+
+        # Levels depend on the source path and any lazy crops
+        key = f"{os.path.abspath(self.path)}{self._crop_windows}"
+        digest = hashlib.md5(key.encode()).hexdigest()[:8]
+        name = f"{self.filename}_{digest}_{np.dtype(self.dtype).name}_level{n}.npy"
+
+        return os.path.join(self.pyramid_dir, name)
+
+    @property
+    def is_loaded(self):
+        """
+        Return True if the image is currently held in memory.
+        """
+        return self._img is not None
+
+    def _read(self):
+        """
+        Read and decode the grayscale image from disk, applying any lazy crops.
+        """
+        if self.memmap_dir:
+            img = self._read_memmap()
+        else:
+            img = self.dtype(cv2.imread(self.path, cv2.IMREAD_GRAYSCALE))
+
+        for window in self._crop_windows:
+            img = self._crop(img, *window)
+
+        return img
+
+    def read_window(self, top, bottom, left, right):
+        """
+        Return a window of the image. If the image isn't loaded, only the window is read from disk
+        when the file format allows it, otherwise the whole image is read.
+        """
+        if self._img is not None or self.memmap_dir:
+            return self.img[top:bottom, left:right]
+
+        window = self._read_window(top, bottom, left, right)
+
+        if window is None:
+            return self.img[top:bottom, left:right]
+
+        return window
+
+    def _read_window(self, top, bottom, left, right):
+        """
+        Read and decode a window of the image from disk, applying any lazy crops. Returns None if
+        the file can't be read by window.
+        """
+        header = self._read_header()
+        if TIFF_IMAGE_WIDTH not in header or TIFF_IMAGE_LENGTH not in header:
+            return None
+
+        height, width = header[TIFF_IMAGE_LENGTH], header[TIFF_IMAGE_WIDTH]
+        window = np.zeros((bottom - top, right - left), dtype=self.dtype)
+
+        # Read the part of the window that is within the source image
+        source_bottom, source_right = min(bottom, height), min(right, width)
+        if source_bottom > top and source_right > left:
+            source = utils.read_tiff_window(
+                self.path, top, source_bottom, left, source_right)
+
+            if source is None:
+                return None
+
+            window[:source_bottom - top, :source_right -
+                   left] = self.dtype(self._to_grayscale(source))
+
+        # Lazy crops fill pixels that are outside of the previous image extent
+        rows = np.arange(top, bottom)[:, np.newaxis]
+        cols = np.arange(left, right)[np.newaxis, :]
+        for crop_height, crop_width, fill in self._crop_windows:
+            window[(rows >= height) | (cols >= width)] = fill
+            height, width = crop_height, crop_width
+
+        return window
+
+    def _to_grayscale(self, img):
+        """
+        Convert a decoded (height, width, samples) array to 8-bit grayscale, matching how images are
+        read with cv2.IMREAD_GRAYSCALE.
+        """
+        if img.dtype == np.uint16:
+            img = (img >> 8).astype(np.uint8)
+
+        if img.shape[2] >= 3:
+            return cv2.cvtColor(np.ascontiguousarray(img[..., :3]), cv2.COLOR_RGB2GRAY)
+
+        return img[..., 0]
+
+    @property
+    def memmap_path(self):
+        """
+        Return the path of the memory-mapped image cache, or None if memory-mapping isn't used.
+        """
+        if not self.memmap_dir:
+            return None
+
+        # Include a hash of the source path so that photos with the same name don't collide
+        digest = hashlib.md5(os.path.abspath(
+            self.path).encode()).hexdigest()[:8]
+        name = f"{self.filename}_{digest}_{np.dtype(self.dtype).name}.npy"
+
+        return os.path.join(self.memmap_dir, name)
+
+    def _read_memmap(self):
+        """
+        Memory-map the decoded image, decoding it into the cache first if the cache is missing or
+        older than the source image.
+        """
+        cache_path = self.memmap_path
+
+        if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(self.path):
+            img = self.dtype(cv2.imread(self.path, cv2.IMREAD_GRAYSCALE))
+            os.makedirs(self.memmap_dir, exist_ok=True)
+
+            # Write to a temporary file first so that a partial cache is never memory-mapped
+            temp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                np.save(f, img)
+            os.replace(temp_path, cache_path)
+
+        return np.load(cache_path, mmap_mode="r")
+
+    def _read_header(self):
+        """
+        Read image metadata from the file header without decoding pixels. Returns None if the
+        file header can't be read.
+        """
+        if self._header is None:
+            try:
+                self._header = utils.read_tiff_tags(self.path, [TIFF_IMAGE_WIDTH, TIFF_IMAGE_LENGTH,
+                                                                TIFF_X_RESOLUTION, TIFF_Y_RESOLUTION,
+                                                                TIFF_RESOLUTION_UNIT])
+            except (OSError, struct.error):
+                self._header = None
+
+            # Cache failed reads so that the header is only read once
+            if self._header is None:
+                self._header = {}
+
+        return self._header
+
+    def release(self):
+        """
+        Release the image from memory. It will be read from disk again on next access, so any
+        unsaved processing will be lost.
+        """
+        # Levels of a modified image won't match the image when it is read again
+        if self._modified:
+            self._levels = {}
+
+        self._img = None
+        self._modified = False
 
     @property
     def fiducials(self):
@@ -36,6 +304,25 @@ class Photo:
             return True
         return False
 
+    @property
+    def header_dpi(self):
+        """
+        Return the scanning (vertical, horizontal) dots per inch recorded in the file header, or
+        None if the resolution isn't recorded.
+        """
+        header = self._read_header()
+
+        if TIFF_X_RESOLUTION not in header or TIFF_Y_RESOLUTION not in header:
+            return None
+
+        unit = header.get(TIFF_RESOLUTION_UNIT)
+        if unit == TIFF_UNIT_NONE or not header[TIFF_X_RESOLUTION] or not header[TIFF_Y_RESOLUTION]:
+            return None
+
+        scale = 2.54 if unit == TIFF_UNIT_CENTIMETER else 1
+
+        return (header[TIFF_Y_RESOLUTION] * scale, header[TIFF_X_RESOLUTION] * scale)
+
     @property
     def dpi(self):
         """
@@ -126,18 +413,31 @@ class Photo:
         """
         Return image height in pixels
         """
-        return self.img.shape[0]
+        return self.size[0]
 
     @property
     def width(self):
         """
         Return image width in pixels
         """
-        return self.img.shape[1]
+        return self.size[1]
 
     @property
     def size(self):
-        return (self.height, self.width)
+        """
+        Return image (height, width) in pixels. If the image isn't loaded, the size is read from
+        the file header when possible.
+        """
+        if self._img is None:
+            if self._crop_windows:
+                return tuple(self._crop_windows[-1][:2])
+
+            header = self._read_header()
+
+            if TIFF_IMAGE_WIDTH in header and TIFF_IMAGE_LENGTH in header:
+                return (header[TIFF_IMAGE_LENGTH], header[TIFF_IMAGE_WIDTH])
+
+        return (self.img.shape[0], self.img.shape[1])
 
     @property
     def filename(self):
@@ -153,34 +453,116 @@ class Photo:
         """
         return os.path.splitext(os.path.basename(self.path))[1]
 
-    def crop(self, height, width, fill=0):
+    def crop(self, height, width, fill=0, lazy=False):
         """
         Crop the image to a new size, anchored at the top left. If the crop size
         is larger than the current image, new pixels will be added with the fill value.
+        If the crop fits within the image, the cropped image is a view of the original
+        and no pixels are copied.
+        @param {bool, default False} lazy If true and the image isn't loaded, the crop is
+        recorded and applied whenever the image is read rather than reading it now.
+        """
+        if lazy and self._img is None:
+            self._crop_windows.append((height, width, fill))
+            self._levels = {}
+            return
+
+        self.img = self._crop(self.img, height, width, fill)
+
+    def _crop(self, img, height, width, fill):
+        """
+        Return an image cropped to a new size, anchored at the top left.
+        """
+        if height <= img.shape[0] and width <= img.shape[1]:
+            return img[0:height, 0:width]
+
+        cropped = np.full((height, width), fill, dtype=img.dtype)
+
+        copy_height = min(height, img.shape[0])
+        copy_width = min(width, img.shape[1])
+
+        cropped[0:copy_height, 0:copy_width] = img[0:copy_height, 0:copy_width]
+
+        return cropped
+
+    def rectify(self, transform, size=None, interpolation=cv2.INTER_LINEAR, fill=0):
+        """
+        Resample the image into a new frame, such as a common fiducial frame. Located fiducials
+        are not moved, so they should be located again if they are needed.
+        @param {np.ndarray} transform A 3x3 affine or projective transform from image coordinates
+        to frame coordinates
+        @param {tuple, default None} size The (height, width) of the frame. If None, the image
+        size is used.
+        @param {int, default cv2.INTER_LINEAR} interpolation The cv2 interpolation method
+        @param {int, default 0} fill The value of frame pixels outside of the image
         """
-        cropped = np.full((height, width), fill)
+        self.img = self._rectify(
+            self.img, transform, size or self.size, interpolation, fill)
 
-        copy_height = min(height, self.img.shape[0])
-        copy_width = min(width, self.img.shape[1])
+    def _rectify(self, img, transform, size, interpolation, fill):
+        """
+        Return an image resampled into a frame of a given (height, width)
+        """
+        height, width = size
+        transform = np.asarray(transform, dtype=np.float64)
 
-        cropped[0:copy_height, 0:copy_width] = self.img[0:copy_height, 0:copy_width]
+        if np.allclose(transform[2], (0, 0, 1)):
+            return cv2.warpAffine(img, transform[:2], (width, height), flags=interpolation,
+                                  borderMode=cv2.BORDER_CONSTANT, borderValue=fill)
 
-        self.img = cropped
+        return cv2.warpPerspective(img, transform, (width, height), flags=interpolation,
+                                   borderMode=cv2.BORDER_CONSTANT, borderValue=fill)
 
-    def preview(self, size=(8, 8), cmap="gray", ax=None, index=None):
+    def preview(self, size=(8, 8), cmap="gray", ax=None, index=None, downsample=True):
+        """
+        Display the image with its fiducials
+        @param {bool, default True} downsample If true, the image is downsampled to the resolution
+        of the plot before it is displayed. Plot coordinates are always full resolution pixels.
+        """
         if ax is None:
             _, ax = plt.subplots(figsize=size)
-            ax.imshow(self.img, cmap=cmap)
+            axis = ax
         else:
-            ax[index].imshow(self.img, cmap=cmap)
+            axis = ax[index]
+
+        img = self.preview_image(axis) if downsample else self.img
+        axis.imshow(img, cmap=cmap, extent=self.preview_extent)
 
         self.fiducials.preview(ax=ax, index=index)
 
+    def _preview_factor(self, ax):
+        """
+        Return the largest power of two that the image can be downsampled by while still having
+        at least as many pixels as a plot axis.
+        """
+        bbox = ax.get_window_extent()
+        ratio = min(self.height / max(bbox.height, 1),
+                    self.width / max(bbox.width, 1))
+
+        return 2 ** int(np.log2(ratio)) if ratio >= 2 else 1
+
+    def preview_image(self, ax):
+        """
+        Return the pyramid level of the image that matches the resolution of a plot axis
+        """
+        return self.level(int(np.log2(self._preview_factor(ax))))
+
+    @property
+    def preview_extent(self):
+        """
+        Return the plot extent that places a preview image of any resolution in full resolution
+        pixel coordinates
+        """
+        return (-0.5, self.width - 0.5, self.height - 0.5, -0.5)
+
     def _match_histogram(self, reference):
         """
-        Match the photo histogram to a reference photo.
+        Match the photo histogram to a reference photo or a precomputed reference Histogram.
         """
-        self.img = self.dtype(match_histograms(self.img, reference.img))
+        if isinstance(reference, Photo):
+            reference = Histogram(reference.img)
+
+        self.img = reference.match(self.img, self.dtype)
 
     def border_box(self, width):
         """
@@ -211,10 +593,57 @@ class Photo:
         boxes = self.fiducials.get_fiducial_bboxes(size)
         return BoundingBoxCollection(boxes, self)
 
-    def save(self, path, suffix="_processed", dtype=np.uint8):
+    def apply_mask(self, mask, fill=0):
+        """
+        Fill the masked pixels of the image in place. The image is only copied if it can't be
+        written to directly, e.g. if it is a read-only memory map.
+        @param {BoundingBoxCollection, Mask} mask The boxes or mask to fill
+        @param {int, default 0} fill The value to fill masked pixels with
+        """
+        img = self.img
+
+        if not (img.flags.writeable and img.flags.c_contiguous) or isinstance(img, np.memmap):
+            img = np.array(img, order="C")
+
+        self._to_mask(mask).fill(img, fill)
+        self.img = img
+
+    def _to_mask(self, mask):
+        """
+        Convert boxes to a Mask of the photo
+        """
+        if isinstance(mask, BoundingBoxCollection):
+            return mask.to_mask()
+
+        if mask.shape != tuple(self.size):
+            raise ValueError(
+                f"Mask shape {mask.shape} doesn't match photo size {tuple(self.size)}.")
+
+        return mask
+
+    def save(self, path, suffix="_processed", dtype=np.uint8, release=False, mask=None, fill=0):
+        """
+        Save the image to a file
+        @param {BoundingBoxCollection, Mask, default None} mask If given, masked pixels are
+        filled in the saved image. The mask is filled directly into the converted output image,
+        and the photo's own image is left unmasked.
+        @param {int, default 0} fill The value to fill masked pixels with
+        """
         out_path = os.path.join(path, self.filename + self.extension)
         out_path = utils.add_suffix(out_path, suffix)
 
-        self.img = dtype(self.img)
+        if mask is None:
+            self.img = dtype(self.img)
+
+            utils.write_image(out_path, self.img)
+        else:
+            # The image is converted into a single new array, which the mask is filled into
+            out = np.array(self.img, dtype=dtype, order="C")
+            self._to_mask(mask).fill(out, fill)
+
+            utils.write_image(out_path, out)
+
+        if release:
+            self.release()
 
-        cv2.imwrite(out_path, self.img)
+        return out_path
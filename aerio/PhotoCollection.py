@@ -1,47 +1,186 @@
+import copy
+import cv2
+from itertools import repeat
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+from aerio.Cache import Cache
+from aerio.Executor import Executor
+from aerio.FiducialBatch import FiducialBatch
+from aerio.Histogram import Histogram
+from aerio.InteriorOrientation import InteriorOrientation
+from aerio.Manifest import Manifest
 from aerio.Photo import Photo
+from aerio.Pipeline import Pipeline
+
+
+# Per-photo operations are defined at the module level so that they can be sent to worker processes.
+# Each returns its result rather than relying on the photo being modified in place.
+def _crop_photo(photo, height, width, fill):
+    photo.crop(height, width, fill)
+    return photo.img
+
+
+def _match_photo_histogram(photo, reference):
+    photo._match_histogram(reference)
+    return photo.img
+
+
+def _locate_photo_fiducials(photo, size, kernel_size, iterations, threshold, block_size,
+                            template=None, windows=None, subpixel=False, positions=None):
+    photo.fiducials.locate(size, kernel_size, iterations, threshold,
+                           block_size, template, windows, subpixel, positions)
+    return photo.fiducials.fiducials
+
+
+# The fiducial template of each worker process, sent once when the worker starts
+_worker_template = None
+
+
+def _set_worker_template(template):
+    global _worker_template
+    _worker_template = template
+
+
+def _match_photo_fiducials(photo, size, windows=None, positions=None):
+    photo.fiducials.locate(size, template=_worker_template,
+                           windows=windows, positions=positions)
+    return photo.fiducials.fiducials
+
+
+def _rectify_photo(photo, transform, size, interpolation, fill, path=None, suffix=None, dtype=None,
+                   release=False):
+    if path is None:
+        photo.rectify(transform, size, interpolation, fill)
+        return photo.img
+
+    # The rectified image is saved from a copy of the photo, so the original is left unchanged
+    photo = copy.copy(photo)
+    photo.rectify(transform, size, interpolation, fill)
+    return photo.save(path, suffix, dtype, release)
+
+
+def _save_photo(photo, path, suffix, dtype, release, mask=None, fill=0):
+    return photo.save(path, suffix, dtype, release, mask, fill)
+
+
+def _to_cache(cache):
+    return cache if isinstance(cache, Cache) else Cache(cache)
 
 
 class PhotoCollection:
-    def __init__(self, photo_paths, dpi=None, photo_size=None, pixel_size=None, dtype=np.uint8):
+    def __init__(self, photo_paths, dpi=None, photo_size=None, pixel_size=None, dtype=np.uint8, lazy=False,
+                 executor=Executor.SERIAL, workers=None, dpi_from_header=False, memmap_dir=None,
+                 pyramid_dir=None):
+        """
+        @param {bool, default False} lazy If true, images are not read until they are first
+        accessed, so large collections can be created without holding every image in memory.
+        @param {str or Executor, default "serial"} executor How collection operations are run:
+        "serial", "thread", "process", or an Executor instance. With a process pool, lazy photos
+        that haven't been loaded are sent to workers as paths and read there.
+        @param {int, default None} workers The number of pool workers. If None, the number of
+        processors on the machine is used.
+        @param {bool, default False} dpi_from_header If true and no dpi, photo size, or pixel size is
+        given, each photo's dpi is read from the resolution recorded in its file header.
+        @param {str, default None} memmap_dir If given, each image is decoded once into an
+        uncompressed cache in this directory and memory-mapped from there.
+        @param {str, default None} pyramid_dir If given, reduced resolution levels of each
+        unmodified image are saved in this directory and reused.
+        """
+        if not isinstance(executor, Executor):
+            executor = Executor(executor, workers)
+        self.executor = executor
+
         self.photos = self._load_photos(
-            photo_paths, dpi, photo_size, pixel_size, dtype)
+            photo_paths, dpi, photo_size, pixel_size, dtype, lazy, dpi_from_header, memmap_dir, pyramid_dir)
 
-    def _load_photos(self, photo_paths, dpi, photo_size, pixel_size, dtype):
+    def _load_photos(self, photo_paths, dpi, photo_size, pixel_size, dtype, lazy, dpi_from_header, memmap_dir,
+                     pyramid_dir):
         """
         Instantiate and return all photos
         """
-        photos = [Photo(path, dpi, photo_size, pixel_size, dtype)
+        photos = [Photo(path, dpi, photo_size, pixel_size, dtype, lazy, dpi_from_header, memmap_dir, pyramid_dir)
                   for path in photo_paths]
 
         return photos
 
-    def crop(self, height=None, width=None):
+    def crop(self, height=None, width=None, fill=0, lazy=False):
         """
         Crop all photos in the collection to the same size. If no size is
         provided, the smallest dimensions from all photos will be used.
+        @param {bool, default False} lazy If true, photos that aren't loaded are cropped
+        when they are read rather than now.
         """
         if not height:
             height = min([photo.height for photo in self.photos])
         if not width:
             width = min([photo.width for photo in self.photos])
 
-        for photo in self.photos:
-            photo.crop(height, width)
+        if lazy:
+            [photo.crop(height, width, fill, lazy) for photo in self.photos]
+            return
+
+        imgs = self.executor.map(
+            _crop_photo, self.photos, repeat(height), repeat(width), repeat(fill))
+
+        for photo, img in zip(self.photos, imgs):
+            photo.img = img
 
     def __getitem__(self, i):
         return self.photos[i]
 
-    def match_histograms(self, reference_index=0):
+    def match_histograms(self, reference_index=0, reference_level=0, cache=None):
         """
         Histogram match all photos, using one of the photos as a reference. 
         @param {int, default 0} reference_index The index of the photo to use as reference.
+        @param {int, default 0} reference_level The pyramid level of the reference photo to
+        estimate its histogram from. Higher levels are faster but approximate.
+        @param {Cache or str, default None} cache A Cache or cache directory. If given, the
+        reference histogram and matched images are reused from previous runs where possible.
+        """
+        if cache is None:
+            # The reference distribution is computed once and shared by every photo
+            reference = Histogram(
+                self.photos[reference_index].level(reference_level))
+            photos, keys = self.photos, None
+        else:
+            cache = _to_cache(cache)
+            reference = cache.memoize(self.photos[reference_index], "histogram",
+                                      lambda photo, level: Histogram(photo.level(level)),
+                                      level=reference_level)
+            photos, keys = self._cached(cache, "match_histograms",
+                                        lambda photo, img: setattr(photo, "img", img),
+                                        reference=reference)
+
+        imgs = self.executor.map(
+            _match_photo_histogram, photos, repeat(reference))
+
+        for i, (photo, img) in enumerate(zip(photos, imgs)):
+            photo.img = img
+
+            if keys is not None:
+                cache.set(keys[i], img)
+
+    def _cached(self, cache, operation, restore, **params):
         """
-        reference = self.photos[reference_index]
+        Restore the stored results of an operation for every photo that has one. Keys are found
+        for every photo before any photo is changed.
+        @param {function} restore A function that takes a photo and its stored result
+        @return {tuple} The photos without stored results and their keys
+        """
+        keys = [cache.key(photo, operation, params) for photo in self.photos]
+        missing, missing_keys = [], []
+
+        for photo, key in zip(self.photos, keys):
+            value = cache.get(key)
 
-        for photo in self.photos:
-            photo._match_histogram(reference)
+            if value is None:
+                missing.append(photo)
+                missing_keys.append(key)
+            else:
+                restore(photo, value)
+
+        return missing, missing_keys
 
     def __repr__(self):
         return repr(self.photos)
@@ -55,10 +194,359 @@ class PhotoCollection:
         for i, photo in enumerate(self.photos):
             photo.preview(cmap="gray", ax=ax, index=i)
 
-    def locate_fiducials(self, size, kernel_size=None, iterations=4, threshold=False, block_size=999):
-        for photo in self.photos:
-            photo.fiducials.locate(
-                size, kernel_size, iterations, threshold, block_size)
+    def locate_fiducials(self, size, kernel_size=None, iterations=4, threshold=False, block_size=999,
+                         batched=False, template=None, adaptive=False, samples=5, margin=None,
+                         subpixel=False, cache=None):
+        """
+        Locate the fiducials in every photo.
+        @param {bool, default False} batched If true, fiducials at the same position in every photo
+        are filtered and located together in a few whole-array operations rather than photo by photo.
+        @param {FiducialTemplate, default None} template If given, fiducials are located by matching
+        them to templates from a reference photo, e.g. FiducialTemplate(collection[0].fiducials).
+        @param {bool, default False} adaptive If true, fiducials are first located in a few sample
+        photos. Tight search windows around the sampled fiducials are then used for the rest of the
+        collection, and photos whose fiducials aren't found within them are located again with the
+        full size windows. Each window is checked against the sampled photos first, and positions
+        whose windowed results differ from the full size results use the full size window.
+        @param {int, default 5} samples The number of photos to sample in adaptive mode
+        @param {int, default None} margin The number of pixels to add around the sampled fiducials
+        in adaptive mode. If None, the reach of the morphological filter is used.
+        @param {bool, default False} subpixel If true, corners are refined to sub-pixel accuracy
+        @param {Cache or str, default None} cache A Cache or cache directory. If given, fiducials
+        are reused from previous runs on the same photos with the same parameters. Adaptive mode
+        can't be cached, since its results depend on the sampled photos.
+        @return {list} In adaptive mode, the search window used for each fiducial position
+        """
+        args = (size, kernel_size, iterations, threshold,
+                block_size, batched, template, subpixel)
+
+        if cache is not None:
+            if adaptive:
+                raise ValueError(
+                    "Fiducials located in adaptive mode can't be cached.")
+
+            # Batching doesn't change the results, so it isn't part of the key
+            cache = _to_cache(cache)
+            photos, keys = self._cached(cache, "locate_fiducials",
+                                        lambda photo, fiducials: setattr(
+                                            photo.fiducials, "fiducials", fiducials),
+                                        size=size, kernel_size=kernel_size, iterations=iterations,
+                                        threshold=threshold, block_size=block_size,
+                                        template=template, subpixel=subpixel)
+            if photos:
+                self._locate_fiducials(photos, *args)
+
+            for photo, key in zip(photos, keys):
+                cache.set(key, photo.fiducials.fiducials)
+
+            self._score_deviation()
+            return
+
+        if not adaptive:
+            self._locate_fiducials(self.photos, *args)
+            self._score_deviation()
+            return
+
+        # Sample photos evenly across the collection
+        sampled = set(np.linspace(0, len(self.photos) - 1,
+                                  min(samples, len(self.photos))).round().astype(int))
+        self._locate_fiducials([self.photos[i] for i in sampled], *args)
+
+        if margin is None:
+            margin = (kernel_size or self.photos[0].height // 200) * iterations
+        windows = self._fiducial_windows(
+            [self.photos[i] for i in sampled], margin)
+        windows = self._check_windows(
+            [self.photos[i] for i in sampled], windows, args)
+
+        remaining = [photo for i, photo in enumerate(self.photos) if i not in sampled]
+        self._locate_fiducials(remaining, *args, windows=windows)
+
+        # Fiducials that are missing or on the edge of their window may lie outside of it
+        failed = [photo for photo in remaining if self._on_window_edge(photo)]
+        if failed:
+            self._locate_fiducials(failed, *args)
+
+        self._score_deviation()
+
+        return windows
+
+    def _locate_fiducials(self, photos, size, kernel_size, iterations, threshold, block_size, batched,
+                          template, subpixel, windows=None, positions=None):
+        """
+        Locate the fiducials in a list of photos. If positions are given, only the fiducials at
+        the positions listed for each photo are located.
+        """
+        if batched and template is None and positions is None:
+            FiducialBatch(photos).locate(size, kernel_size, iterations, threshold, block_size, windows,
+                                         subpixel)
+            return
+
+        if template is not None and self.executor.kind == Executor.PROCESS:
+            # Templates cache their FFTs, so each worker process gets one copy to reuse for all of
+            # its photos rather than a fresh copy with every photo
+            located = self.executor.map(_match_photo_fiducials, photos, repeat(size), repeat(windows),
+                                        positions or repeat(None), initializer=_set_worker_template,
+                                        initargs=(template,))
+        else:
+            located = self.executor.map(_locate_photo_fiducials, photos, repeat(size), repeat(kernel_size),
+                                        repeat(iterations), repeat(threshold), repeat(block_size),
+                                        repeat(template), repeat(windows),
+                                        repeat(subpixel), positions or repeat(None))
+
+        for photo, fiducials in zip(photos, located):
+            photo.fiducials.fiducials = fiducials
+
+    def _score_deviation(self):
+        """
+        Score each fiducial by its distance from its expected position. The expected position of
+        each fiducial relative to the center of its photo's fiducials is the median across all
+        photos with four located fiducials. Fiducials of photos with missing fiducials are None.
+        """
+        coordinates = self.fiducial_coordinates
+
+        offsets = coordinates - coordinates.mean(axis=1, keepdims=True)
+        complete = ~np.isnan(offsets).any(axis=(1, 2))
+
+        if complete.any():
+            expected = np.median(offsets[complete], axis=0)
+            deviations = np.linalg.norm(offsets - expected, axis=2)
+        else:
+            deviations = np.full(offsets.shape[:2], np.nan)
+
+        for photo, photo_deviations in zip(self.photos, deviations):
+            for fiducial, deviation in zip(photo.fiducials.fiducials, photo_deviations):
+                if fiducial is not None:
+                    fiducial.quality["deviation"] = None if np.isnan(
+                        deviation) else float(deviation)
+
+    @property
+    def fiducial_coordinates(self):
+        """
+        Return the (x, y) coordinates of every photo's fiducials (top, right, bottom, left) as an
+        (n photos, 4, 2) array, with NaN for fiducials that haven't been located
+        """
+        return np.array([[c if c is not None else (np.nan, np.nan)
+                          for c in photo.fiducials.coordinates] for photo in self.photos],
+                        dtype=np.float64).reshape(-1, 4, 2)
+
+    def interior_orientation(self, calibrated, model=InteriorOrientation.AFFINE):
+        """
+        Solve the transform from each photo's fiducials to calibrated fiducial positions, for every
+        photo in one batched least squares solve. Fiducials must be located first.
+        @param {np.ndarray} calibrated The calibrated (x, y) position of each fiducial (top, right,
+        bottom, left), e.g. from a camera calibration report
+        @param {str, default "affine"} model The transform to solve: "affine" or "projective"
+        @return {InteriorOrientation} The transforms, residuals, and RMSE of every photo
+        """
+        return InteriorOrientation(self.fiducial_coordinates, calibrated, model)
+
+    def rectify(self, path=None, target=None, model=InteriorOrientation.AFFINE, transforms=None, size=None,
+                suffix="_rectified", dtype=np.uint8, interpolation=cv2.INTER_LINEAR, fill=0, release=False):
+        """
+        Resample every photo into a common fiducial frame. Fiducials must be located first unless
+        transforms are given.
+        @param {str, default None} path If given, each photo is saved to this directory as soon as
+        it is rectified and the photos in the collection are left unchanged. Otherwise, the photo
+        images are replaced.
+        @param {np.ndarray, default None} target The (x, y) pixel position of each fiducial (top,
+        right, bottom, left) in the frame. If None, the mean position of the fiducials of photos
+        with all four located is used.
+        @param {str, default "affine"} model The transform to solve: "affine" or "projective"
+        @param {np.ndarray, default None} transforms A 3x3 transform from each photo to the frame,
+        or a single transform for every photo, used instead of solving them from fiducials
+        @param {tuple, default None} size The (height, width) of the frame. If None, the largest
+        photo height and width are used.
+        @param {bool, default False} release If true, each photo's image is released from memory
+        after it is saved.
+        @return {list} The paths of the saved photos, if a path is given
+        """
+        if transforms is None:
+            transforms = self._frame_transforms(target, model)
+        transforms = np.broadcast_to(np.asarray(transforms, dtype=np.float64),
+                                     (len(self.photos), 3, 3))
+
+        if size is None:
+            size = (max(photo.height for photo in self.photos),
+                    max(photo.width for photo in self.photos))
+
+        results = self.executor.map(_rectify_photo, self.photos, transforms, repeat(size),
+                                    repeat(interpolation), repeat(fill), repeat(path),
+                                    repeat(suffix), repeat(dtype), repeat(release))
+
+        if path is None:
+            for photo, img in zip(self.photos, results):
+                photo.img = img
+            return
+
+        out_paths = list(results)
+
+        if release:
+            [photo.release() for photo in self.photos]
+
+        return out_paths
+
+    def _frame_transforms(self, target, model):
+        """
+        Solve the transform from each photo's fiducials to their target positions in a common frame
+        """
+        coordinates = self.fiducial_coordinates
+
+        if target is None:
+            complete = np.isfinite(coordinates).all(axis=(1, 2))
+            if not complete.any():
+                raise ValueError(
+                    "All four fiducials must be located in at least one photo to find a common frame.")
+
+            target = coordinates[complete].mean(axis=0)
+
+        orientation = InteriorOrientation(coordinates, target, model)
+
+        if not orientation.solved.all():
+            unsolved = np.nonzero(~orientation.solved)[0].tolist()
+            raise ValueError(
+                f"Photos {unsolved} don't have enough located fiducials to be rectified.")
+
+        return orientation.transforms
+
+    def low_confidence_fiducials(self, min_response=None, max_symmetry=None, max_deviation=None,
+                                 min_score=None):
+        """
+        Return the fiducials that are missing or were located with low confidence. Quality scores
+        that couldn't be calculated are not checked.
+        @param {float, default None} min_response The minimum corner response of fiducials located
+        by corner finding. Responses depend on the image contrast and filter settings.
+        @param {float, default None} max_symmetry The maximum distance in pixels from the position
+        mirrored from the opposite fiducial
+        @param {float, default None} max_deviation The maximum distance in pixels from the position
+        expected from other photos. If no limits are given, five times the median deviation is used.
+        @param {float, default None} min_score The minimum normalized cross correlation, from -1 to
+        1, of fiducials located by template matching
+        @return {list} A (photo index, fiducial position) tuple for each low confidence fiducial
+        """
+        if min_response is None and min_score is None and max_symmetry is None and max_deviation is None:
+            deviations = [fiducial.quality["deviation"] for photo in self.photos
+                          for fiducial in photo.fiducials.fiducials
+                          if fiducial is not None and fiducial.quality["deviation"] is not None]
+            max_deviation = max(5 * np.median(deviations), 1) if deviations else None
+
+        limits = (("response", min_response, np.less), ("score", min_score, np.less),
+                  ("symmetry", max_symmetry, np.greater), ("deviation", max_deviation, np.greater))
+
+        low_confidence = []
+        for index, photo in enumerate(self.photos):
+            for position, fiducial in enumerate(photo.fiducials.fiducials):
+                if fiducial is None or fiducial.coordinates is None:
+                    low_confidence.append((index, position))
+                    continue
+
+                if any(limit is not None and fiducial.quality.get(name) is not None
+                       and compare(fiducial.quality[name], limit) for name, limit, compare in limits):
+                    low_confidence.append((index, position))
+
+        return low_confidence
+
+    def retry_fiducials(self, size, kernel_size=None, iterations=4, threshold=False, block_size=999,
+                        template=None, subpixel=False, min_response=None, max_symmetry=None,
+                        max_deviation=None, min_score=None):
+        """
+        Locate only the low confidence fiducials again, e.g. with a larger size, thresholding, or a
+        template. Fiducials are selected with low_confidence_fiducials and the other arguments are
+        the same as for locate_fiducials.
+        @return {list} A (photo index, fiducial position) tuple for each fiducial that was retried
+        """
+        retried = self.low_confidence_fiducials(
+            min_response, max_symmetry, max_deviation, min_score)
+
+        positions = {}
+        for index, position in retried:
+            positions.setdefault(index, []).append(position)
+
+        self._locate_fiducials([self.photos[index] for index in positions], size, kernel_size, iterations,
+                               threshold, block_size, False, template, subpixel,
+                               positions=list(positions.values()))
+        self._score_deviation()
+
+        return retried
+
+    def _fiducial_windows(self, photos, margin):
+        """
+        Return a search window for each fiducial position that contains the located fiducials of
+        a list of photos plus a margin. Windows are relative to the top left of the default window.
+        Positions without any located fiducials have no window.
+        """
+        windows = []
+
+        for position in range(4):
+            points = [photo.fiducials.fiducials[position]._coordinates for photo in photos
+                      if photo.fiducials.fiducials[position] is not None
+                      and photo.fiducials.fiducials[position]._coordinates is not None]
+
+            if not points:
+                windows.append(None)
+                continue
+
+            # Coordinates are relative to each window, which is the default window here
+            x, y = np.array(points, dtype=np.float64).T
+            windows.append((int(np.floor(y.min())) - margin, int(np.ceil(y.max())) + margin + 1,
+                            int(np.floor(x.min())) - margin, int(np.ceil(x.max())) + margin + 1))
+
+        return windows
+
+    def _check_windows(self, photos, windows, args, tolerance=0.5):
+        """
+        Locate the fiducials of the sampled photos again within the search windows. Cropping
+        changes the normalization and filtering context of each fiducial, which can change which
+        corner wins, so positions where any sampled fiducial moves by more than a tolerance in
+        pixels fall back to the default window. The sampled photos keep their default results.
+        """
+        located = [photo.fiducials.fiducials for photo in photos]
+        expected = [photo.fiducials.coordinates for photo in photos]
+
+        self._locate_fiducials(photos, *args, windows=windows)
+
+        for position in range(4):
+            if windows[position] is None:
+                continue
+
+            for photo, coordinates in zip(photos, expected):
+                windowed = photo.fiducials.coordinates[position]
+
+                if (windowed is None) != (coordinates[position] is None) or (
+                        windowed is not None and np.abs(np.subtract(windowed, coordinates[position])).max() > tolerance):
+                    windows[position] = None
+                    break
+
+        for photo, fiducials in zip(photos, located):
+            photo.fiducials.fiducials = fiducials
+
+        return windows
+
+    def _on_window_edge(self, photo, tolerance=1):
+        """
+        Return True if any fiducial of a photo wasn't located or was located on the edge of its
+        search window
+        """
+        for fiducial in photo.fiducials.fiducials:
+            if fiducial is None or fiducial._coordinates is None:
+                return True
+
+            x, y = fiducial._coordinates
+            height, width = fiducial.img.shape[:2]
+
+            if min(x, y) <= tolerance or x >= width - 1 - tolerance or y >= height - 1 - tolerance:
+                return True
+
+        return False
+
+    def pipeline(self, steps):
+        """
+        Create a pipeline that streams processing steps through the collection one photo at a time.
+        @param {list} steps The processing steps, in order, such as
+        ["crop", "match_histograms", ("locate_fiducials", {"size": (80, 120)})]
+        @return {Pipeline} A pipeline that can be run to process and save the photos
+        """
+        return Pipeline(self, steps)
 
     @property
     def images(self):
@@ -67,8 +555,62 @@ class PhotoCollection:
         """
         return [photo.img for photo in self.photos]
 
-    def save(self, path, suffix="_processed", dtype=np.uint8):
+    def save(self, path, suffix="_processed", dtype=np.uint8, release=False, masks=None, fill=0,
+             manifest=None):
         """
         Save all photo images to hard drive
+        @param {bool, default False} release If true, each image is released from memory after
+        it is saved.
+        @param {list, default None} masks A BoundingBoxCollection or Mask for each photo. Masked
+        pixels are filled in the saved images without modifying the photos.
+        @param {int, default 0} fill The value to fill masked pixels with
+        @param {str or Manifest, default None} manifest A manifest file that records each saved
+        photo. If saving is interrupted, saving again with the same manifest skips photos that
+        were already saved with the same image and settings.
+        @return {list} The paths of the saved photos
         """
-        [photo.save(path, suffix, dtype) for photo in self.photos]
+        if masks is None:
+            masks = [None] * len(self.photos)
+        elif len(masks) != len(self.photos):
+            raise ValueError(
+                f"Expected a mask for each of the {len(self.photos)} photos, not {len(masks)}.")
+
+        # Boxes are converted to masks so that workers don't receive a copy of each box's photo
+        masks = [None if mask is None else photo._to_mask(mask)
+                 for photo, mask in zip(self.photos, masks)]
+
+        out_paths = [None] * len(self.photos)
+        pending = list(range(len(self.photos)))
+
+        if manifest is not None:
+            if not isinstance(manifest, Manifest):
+                manifest = Manifest(manifest)
+
+            signatures = [manifest.signature(photo, None if mask is None else mask._stored(),
+                                             os.path.abspath(path), suffix, dtype, fill)
+                          for photo, mask in zip(self.photos, masks)]
+            pending = []
+
+            for i, photo in enumerate(self.photos):
+                record = manifest.get(photo, signatures[i])
+
+                if record is None:
+                    pending.append(i)
+                else:
+                    out_paths[i] = record["output"]
+
+        saved = self.executor.map(_save_photo, [self.photos[i] for i in pending], repeat(path),
+                                  repeat(suffix), repeat(dtype), repeat(release),
+                                  [masks[i] for i in pending], repeat(fill))
+
+        for i, out_path in zip(pending, saved):
+            out_paths[i] = out_path
+
+            if manifest is not None:
+                manifest.complete(self.photos[i], signatures[i], out_path)
+
+        # Photos saved in worker processes are copies, so release the originals here
+        if release:
+            [photo.release() for photo in self.photos]
+
+        return out_paths
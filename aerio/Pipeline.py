@@ -0,0 +1,198 @@
+import copy
+import inspect
+from itertools import repeat
+import numpy as np
+import os
+
+from aerio.Fiducial import Fiducial
+from aerio.Fiducials import Fiducials
+from aerio.Histogram import Histogram
+from aerio.Manifest import Manifest
+from aerio.Photo import Photo
+
+
+def _apply_step(photo, step):
+    """
+    Apply a single resolved pipeline step to a photo.
+    """
+    if callable(step):
+        step(photo)
+        return
+
+    name, kwargs = step
+
+    if name == "locate_fiducials":
+        photo.fiducials.locate(**kwargs)
+    else:
+        getattr(photo, name)(**kwargs)
+
+
+def _process_photo(photo, steps, path, suffix, dtype):
+    """
+    Read, process, and save a single photo, then release its image. Return the located fiducials
+    and the output path.
+    """
+    for step in steps:
+        _apply_step(photo, step)
+
+    out_path = photo.save(path, suffix, dtype, release=True)
+
+    return photo.fiducials.fiducials, out_path
+
+
+def _restore_fiducials(photo, coordinates):
+    """
+    Restore fiducial coordinates recorded in a manifest. Restored fiducials have no image, so
+    they can be used for orientation and added to photo previews, but not used as templates.
+    """
+    photo.fiducials.fiducials = [None if coords is None else Fiducial.from_coordinates(coords)
+                                 for coords in coordinates]
+
+
+class Pipeline:
+    """
+    A sequence of processing steps that are streamed through a collection one photo at a time. Each
+    photo is read, processed, saved, and released before moving on, so memory use is bounded by the
+    number of photos being processed at once rather than the size of the collection.
+    """
+
+    def __init__(self, collection, steps):
+        """
+        @param {PhotoCollection} collection The photos to process. The collection should be lazy
+        so that photos aren't held in memory before they are processed.
+        @param {list} steps The processing steps, in order. Each step is the name of a collection
+        or photo method, a (name, kwargs) tuple, or a function that takes and modifies a Photo.
+        Collection methods are applied to each photo, so they accept the arguments of the per-photo
+        operation: "crop" takes the arguments of Photo.crop, with height and width defaulting to
+        the minimum size of the collection, "match_histograms" takes reference_index and
+        reference_level, and "locate_fiducials" takes the arguments of Fiducials.locate. Arguments
+        that only apply to a whole collection, such as batched or cache, raise a ValueError.
+        """
+        self.collection = collection
+        self.steps = [self._parse_step(step) for step in steps]
+
+    def __repr__(self):
+        return f"Pipeline({self.steps})"
+
+    def _parse_step(self, step):
+        """
+        Convert a step into a (name, kwargs) tuple or function.
+        """
+        if callable(step):
+            return step
+
+        if isinstance(step, str):
+            step = (step, {})
+
+        name, kwargs = step
+
+        if (name not in ("crop", "match_histograms", "locate_fiducials") and
+                not callable(getattr(Photo, name, None))):
+            raise ValueError(f"\"{name}\" is not a valid pipeline step.")
+
+        if name == "match_histograms":
+            accepted = ("reference_index", "reference_level")
+        elif name == "locate_fiducials":
+            accepted = inspect.signature(Fiducials.locate).parameters
+        else:
+            accepted = inspect.signature(getattr(Photo, name)).parameters
+
+        unsupported = [key for key in kwargs if key not in accepted or key == "self"]
+        if unsupported:
+            raise ValueError(
+                f"The \"{name}\" pipeline step doesn't accept {', '.join(unsupported)}.")
+
+        return (name, dict(kwargs))
+
+    def _resolve_steps(self):
+        """
+        Convert collection-level steps into photo-level steps that can be applied to each photo
+        independently.
+        """
+        photos = self.collection.photos
+        resolved = []
+
+        for step in self.steps:
+            if callable(step):
+                resolved.append(step)
+                continue
+
+            name, kwargs = step[0], dict(step[1])
+
+            if name == "crop":
+                # Default crop size is the minimum size, read from headers where possible
+                if not kwargs.get("height"):
+                    kwargs["height"] = min(photo.height for photo in photos)
+                if not kwargs.get("width"):
+                    kwargs["width"] = min(photo.width for photo in photos)
+
+            elif name == "match_histograms":
+                # The reference is processed by all preceding steps before photos are matched to it
+                reference = copy.copy(
+                    photos[kwargs.pop("reference_index", 0)])
+                reference_level = kwargs.pop("reference_level", 0)
+                reference.img = reference.img.copy()
+
+                # Locating fiducials doesn't change the image, so it can be skipped
+                for previous in resolved:
+                    if callable(previous) or previous[0] != "locate_fiducials":
+                        _apply_step(reference, previous)
+
+                name = "_match_histogram"
+                kwargs = {"reference": Histogram(
+                    reference.level(reference_level))}
+
+            resolved.append((name, kwargs))
+
+        return resolved
+
+    def run(self, path, suffix="_processed", dtype=np.uint8, manifest=None):
+        """
+        Process and save every photo in the collection.
+        @param {str} path The directory to save processed photos to
+        @param {str or Manifest, default None} manifest A manifest file that records each finished
+        photo. If the run is interrupted, running the same pipeline again with the same manifest
+        skips the photos that were finished and restores their fiducial coordinates.
+        @return {list} The paths of the saved photos
+        """
+        steps = self._resolve_steps()
+        photos = self.collection.photos
+        out_paths = [None] * len(photos)
+        pending = list(range(len(photos)))
+
+        if manifest is not None:
+            if not isinstance(manifest, Manifest):
+                manifest = Manifest(manifest)
+
+            signatures = [manifest.signature(photo, steps, os.path.abspath(path), suffix, dtype)
+                          for photo in photos]
+            pending = []
+
+            for i, photo in enumerate(photos):
+                record = manifest.get(photo, signatures[i])
+
+                if record is None:
+                    pending.append(i)
+                else:
+                    _restore_fiducials(photo, record["fiducials"])
+                    out_paths[i] = record["output"]
+
+        results = self.collection.executor.map(_process_photo, [photos[i] for i in pending],
+                                               repeat(steps), repeat(path), repeat(suffix),
+                                               repeat(dtype))
+
+        for i, (fiducials, out_path) in zip(pending, results):
+            photo = photos[i]
+
+            # Photos processed in worker processes are copies, so keep their results here
+            photo.fiducials.fiducials = fiducials
+            photo.release()
+            out_paths[i] = out_path
+
+            if manifest is not None:
+                coordinates = [None if coords is None else [float(coords[0]), float(coords[1])]
+                               for coords in photo.fiducials.coordinates]
+                manifest.complete(photo, signatures[i], out_path,
+                                  fiducials=coordinates)
+
+        return out_paths
@@ -1,4 +1,19 @@
+import cv2
+import numpy as np
 import os
+import struct
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+
+# Struct formats for TIFF field types. Rationals are read as pairs of integers.
+TIFF_FIELD_TYPES = {
+    1: "B", 2: "c", 3: "H", 4: "I", 5: "II", 6: "b", 7: "B", 8: "h",
+    9: "i", 10: "ii", 11: "f", 12: "d", 16: "Q", 17: "q", 18: "Q"
+}
 
 
 def sprint(s, silent=False):
@@ -34,3 +49,185 @@ def add_suffix(file_path, suffix):
 
     full_path = os.path.join(path, name_suffix)
     return full_path
+
+
+def write_image(file_path, img):
+    """
+    Write an image atomically. The image is written to a temporary file in the same directory and
+    then renamed, so an interrupted write never leaves a partial image at the path.
+    @param {str} file_path A relative or absolute path to the image, including its extension
+    @param {np.ndarray} img The image to write
+    @return {str} The path of the written image
+    """
+    path, ext = os.path.splitext(file_path)
+    # The temporary file keeps the extension so that cv2 chooses the same format
+    temp_path = f"{path}.{os.getpid()}.tmp{ext}"
+
+    try:
+        if not cv2.imwrite(temp_path, img):
+            raise OSError(f"Could not write image to {file_path}.")
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return file_path
+
+
+def update_hash(digest, value):
+    """
+    Add a value to a hashlib hash. Arrays are hashed by content, functions and classes by name, and
+    other objects by their public attributes.
+    @param {hashlib hash} digest The hash to update
+    @param value The value to add, such as a dict of parameters
+    """
+    if isinstance(value, np.ndarray):
+        digest.update(f"array{value.dtype.str}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        digest.update(b"{")
+        for name in sorted(value, key=str):
+            update_hash(digest, name)
+            update_hash(digest, value[name])
+        digest.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"[")
+        for item in value:
+            update_hash(digest, item)
+        digest.update(b"]")
+    elif callable(value) and hasattr(value, "__qualname__"):
+        digest.update(f"{value.__module__}.{value.__qualname__}".encode())
+    elif hasattr(value, "__dict__"):
+        digest.update(type(value).__name__.encode())
+        update_hash(digest, {name: item for name, item in vars(value).items()
+                             if not name.startswith("_")})
+    else:
+        digest.update(repr(value).encode())
+
+
+def read_tiff_tags(file_path, tags):
+    """
+    Read selected tags from the first image of a TIFF file without decoding any pixels.
+    @param {str} file_path A relative or absolute path to the TIFF file
+    @param {list} tags Numeric codes of the tags to read, such as 256 for ImageWidth
+    @return {dict} Tag values keyed by tag code, or None if the file is not a TIFF. Single values
+    are returned as scalars, rationals as floats, and multiple values as tuples.
+    """
+    with open(file_path, "rb") as f:
+        header = f.read(16)
+
+        if header[:2] == b"II":
+            order = "<"
+        elif header[:2] == b"MM":
+            order = ">"
+        else:
+            return None
+
+        version = struct.unpack(order + "H", header[2:4])[0]
+
+        # Classic TIFF uses 32-bit offsets, BigTIFF uses 64-bit offsets
+        if version == 42:
+            offset_fmt, count_fmt, entry_size = "I", "H", 12
+            ifd_offset = struct.unpack(order + "I", header[4:8])[0]
+        elif version == 43:
+            offset_fmt, count_fmt, entry_size = "Q", "Q", 20
+            ifd_offset = struct.unpack(order + "Q", header[8:16])[0]
+        else:
+            return None
+
+        value_size = struct.calcsize(offset_fmt)
+
+        f.seek(ifd_offset)
+        n_entries = struct.unpack(
+            order + count_fmt, f.read(struct.calcsize(count_fmt)))[0]
+        entries = f.read(n_entries * entry_size)
+
+        values = {}
+        for i in range(n_entries):
+            entry = entries[i * entry_size:(i + 1) * entry_size]
+            tag, field_type = struct.unpack(order + "HH", entry[:4])
+
+            if tag not in tags or field_type not in TIFF_FIELD_TYPES:
+                continue
+
+            count = struct.unpack(order + offset_fmt, entry[4:4 + value_size])[0]
+            fmt = order + TIFF_FIELD_TYPES[field_type] * count
+            data_size = struct.calcsize(fmt)
+            value_field = entry[4 + value_size:]
+
+            # Values that don't fit in the entry are stored at an offset
+            if data_size <= value_size:
+                data = value_field[:data_size]
+            else:
+                f.seek(struct.unpack(order + offset_fmt, value_field)[0])
+                data = f.read(data_size)
+
+            value = struct.unpack(fmt, data)
+
+            if field_type == 2:
+                value = (b"".join(value).rstrip(b"\x00").decode(errors="replace"),)
+            elif field_type in (5, 10):
+                value = tuple(value[j] / value[j + 1] if value[j + 1] else 0.
+                              for j in range(0, len(value), 2))
+
+            values[tag] = value[0] if len(value) == 1 else value
+
+    return values
+
+
+def read_tiff_window(file_path, top, bottom, left, right):
+    """
+    Read a window from the first image of a TIFF file, decoding only the strips or tiles that overlap
+    it. This requires the optional tifffile package, and imagecodecs for most compressed files.
+    @param {str} file_path A relative or absolute path to the TIFF file
+    @param {int} top, bottom, left, right The pixel extent of the window, which must be within the image
+    @return {np.ndarray} The window, with shape (height, width, samples), or None if the file can't
+    be read by window
+    """
+    if tifffile is None:
+        return None
+
+    try:
+        with tifffile.TiffFile(file_path) as tif:
+            page = tif.pages[0]
+
+            # Planar images store each sample in separate segments, which isn't supported
+            if page.planarconfig == 2 and page.samplesperpixel > 1:
+                return None
+
+            if page.is_tiled:
+                seg_height, seg_width = page.tilelength, page.tilewidth
+            else:
+                seg_height = min(page.rowsperstrip, page.imagelength)
+                seg_width = page.imagewidth
+
+            segments_across = -(-page.imagewidth // seg_width)
+            window = np.zeros((bottom - top, right - left,
+                               page.samplesperpixel), dtype=page.dtype)
+
+            for row in range(top // seg_height, -(-bottom // seg_height)):
+                for col in range(left // seg_width, -(-right // seg_width)):
+                    index = row * segments_across + col
+
+                    tif.filehandle.seek(page.dataoffsets[index])
+                    data = tif.filehandle.read(page.databytecounts[index])
+                    segment, indices, _ = page.decode(
+                        data, index, jpegtables=page.jpegtables)
+
+                    if segment is None:
+                        continue
+
+                    # Segments are (height, width, samples) with the top-left pixel at (y, x)
+                    segment = segment.reshape(segment.shape[-3:])
+                    y, x = indices[-3], indices[-2]
+
+                    y0, y1 = max(top, y), min(bottom, y + segment.shape[0])
+                    x0, x1 = max(left, x), min(right, x + segment.shape[1])
+
+                    window[y0 - top:y1 - top, x0 - left:x1 -
+                           left] = segment[y0 - y:y1 - y, x0 - x:x1 - x]
+
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return window
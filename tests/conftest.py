@@ -0,0 +1,26 @@
+import os
+import sys
+
+import matplotlib
+import pytest
+
+# Plots are drawn without a display
+matplotlib.use("Agg")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_DIR = os.path.join(ROOT, "data")
+
+
+@pytest.fixture(scope="session")
+def paths():
+    """
+    The paths of the sample scans
+    """
+    return [os.path.join(DATA_DIR, f"DWW_3FF_{number}.tif") for number in (117, 118, 119)]
+
+
+@pytest.fixture(scope="session")
+def path(paths):
+    return paths[0]
@@ -0,0 +1,197 @@
+import cv2
+import numpy as np
+import pytest
+
+from aerio.BoundingBox import BoundingBox
+from aerio.BoundingBoxCollection import BoundingBoxCollection
+from aerio.GridIndex import GridIndex
+from aerio.Photo import Photo
+
+
+def rectangle(left, top, width, height):
+    return [[left, top], [left + width, top], [left + width, top + height], [left, top + height]]
+
+
+def random_rectangles(rng, n, shape, max_size=40):
+    height, width = shape
+    lefts = rng.integers(0, width - max_size, n)
+    tops = rng.integers(0, height - max_size, n)
+    sizes = rng.integers(2, max_size, (n, 2))
+
+    return [rectangle(left, top, w, h) for left, top, (w, h) in zip(lefts, tops, sizes)]
+
+
+@pytest.fixture
+def photo(path):
+    return Photo(path, lazy=True)
+
+
+@pytest.fixture
+def boxes(photo):
+    return BoundingBoxCollection(random_rectangles(np.random.default_rng(0), 300, photo.size), photo)
+
+
+def test_boxes_match_their_coordinates(boxes):
+    coords = [box.coords for box in boxes.boxes]
+
+    assert len(boxes) == 300
+    for i in (0, 150, -1):
+        np.testing.assert_array_equal(boxes[i].coords, coords[i])
+        np.testing.assert_allclose(boxes.centroids[i], boxes[i].centroid)
+
+    np.testing.assert_allclose(boxes.areas, [box.area for box in boxes.boxes])
+    np.testing.assert_allclose(boxes.hw_ratios, [box.hw_ratio for box in boxes.boxes])
+    np.testing.assert_allclose(boxes.edge_distances, [box.edge_distance for box in boxes.boxes])
+
+
+def test_filter_matches_box_properties(boxes):
+    kept = [box.coords for box in boxes.boxes if 200 < box.area < 900 and box.hw_ratio < 2]
+
+    boxes.filter(min_area=200, max_area=900, max_hw_ratio=2)
+
+    assert len(boxes) == len(kept)
+    for box, coords in zip(boxes.boxes, kept):
+        np.testing.assert_array_equal(box.coords, coords)
+
+
+def test_add_joins_boxes(photo):
+    first = BoundingBoxCollection([rectangle(0, 0, 5, 5)], photo)
+    second = BoundingBoxCollection([rectangle(10, 10, 5, 5), rectangle(20, 20, 3, 3)], photo)
+
+    combined = first + second + [rectangle(30, 30, 2, 2)]
+
+    assert len(combined) == 4
+    np.testing.assert_array_equal(combined[2].coords, rectangle(20, 20, 3, 3))
+
+    with pytest.raises(ValueError):
+        first + BoundingBoxCollection([], Photo(photo.path, lazy=True))
+
+
+def test_query_and_nearest_match_brute_force(boxes):
+    rng = np.random.default_rng(1)
+    extents = boxes.extents
+
+    for _ in range(50):
+        top, left = rng.integers(0, 1800, 2)
+        region = (top, top + rng.integers(1, 300), left, left + rng.integers(1, 300))
+        expected = np.nonzero((extents[:, 0] <= region[1]) & (extents[:, 1] >= region[0]) &
+                              (extents[:, 2] <= region[3]) & (extents[:, 3] >= region[2]))[0]
+
+        np.testing.assert_array_equal(boxes.index.query(region), expected)
+
+        point = rng.uniform(-100, 2000, 2)
+        k = int(rng.integers(1, 10))
+        distances = boxes.index.distances(point)
+        found = boxes.index.nearest(point, k)
+
+        np.testing.assert_allclose(distances[found], np.sort(distances)[:k])
+
+
+def test_grid_index_bounds_its_size():
+    extents = np.array([[0, 1e-3, 0, 1e-3], [1e6, 1e6 + 1e-3, 1e6, 1e6 + 1e-3]])
+
+    index = GridIndex(extents, cell_size=1e-6)
+
+    assert index.cell_size >= 1e6 / GridIndex.MAX_CELLS
+    np.testing.assert_array_equal(index.nearest((1e6, 1e6), 2), [1, 0])
+    assert len(GridIndex(np.empty((0, 4))).nearest((0, 0))) == 0
+
+
+def test_intersecting(photo, boxes):
+    region = BoundingBoxCollection([rectangle(500, 500, 300, 300)], photo)
+
+    found = boxes.intersecting(region)
+
+    np.testing.assert_array_equal(found.extents, boxes.query(region.extents[0]).extents)
+
+
+def test_roi_mask_matches_full_mask(boxes):
+    full = boxes.generate_mask()
+
+    mask, (top, left) = boxes.generate_mask(roi=True)
+
+    roi = np.full_like(full, 255)
+    roi[top:top + mask.shape[0], left:left + mask.shape[1]] = mask
+    np.testing.assert_array_equal(roi, full)
+
+
+def test_collapse_matches_full_frame_opening(photo):
+    boxes = BoundingBoxCollection(random_rectangles(np.random.default_rng(2), 40, (600, 600)),
+                                  photo)
+    kernel = np.ones((5, 5), np.uint8)
+
+    # The original collapse opened a mask of the full photo
+    opened = cv2.morphologyEx(boxes.generate_mask(), cv2.MORPH_OPEN, kernel, 3)
+    contours, _ = cv2.findContours(np.where(opened == 0, 255, 0).astype(np.uint8), cv2.RETR_LIST,
+                                   cv2.CHAIN_APPROX_SIMPLE)
+    expected = BoundingBoxCollection(list(contours), photo)
+
+    boxes.collapse(kernel)
+
+    assert len(boxes) == len(expected)
+    np.testing.assert_array_equal(boxes.generate_mask(), expected.generate_mask())
+
+
+def test_geometric_collapse_merges_nearby_boxes(photo):
+    boxes = BoundingBoxCollection([rectangle(100, 100, 10, 10), rectangle(113, 102, 10, 10),
+                                   rectangle(300, 300, 10, 10)], photo)
+
+    boxes.collapse(geometric=True, gap=(5, 5))
+
+    assert len(boxes) == 2
+    assert sorted(map(tuple, boxes.extents.tolist())) == [(100, 112, 100, 123),
+                                                          (300, 310, 300, 310)]
+
+
+def test_intersecting_pairs_match_brute_force(boxes):
+    extents = boxes.extents
+    a, b = extents[:, np.newaxis], extents[np.newaxis]
+    touching = (a[..., 0] <= b[..., 1]) & (a[..., 1] >= b[..., 0]) & \
+        (a[..., 2] <= b[..., 3]) & (a[..., 3] >= b[..., 2])
+    expected = np.nonzero(np.triu(touching, 1))
+
+    first, second = GridIndex(extents).intersecting_pairs()
+
+    np.testing.assert_array_equal(first, expected[0])
+    np.testing.assert_array_equal(second, expected[1])
+
+
+@pytest.mark.parametrize("gap, n_boxes", [((3, 3), 5000), ((4, 4), 1)])
+def test_geometric_collapse_of_a_column(photo, gap, n_boxes):
+    # Boxes 4 pixels apart, as in a strip of margin labels
+    boxes = BoundingBoxCollection([rectangle(10, 12 * i, 20, 8) for i in range(5000)], photo)
+
+    boxes.collapse(geometric=True, gap=gap)
+
+    assert len(boxes) == n_boxes
+
+
+def test_geometric_collapse_matches_raster_for_separated_boxes(photo):
+    boxes = BoundingBoxCollection([rectangle(100 + 40 * i, 100 + 30 * (i % 3), 12, 8)
+                                   for i in range(10)], photo)
+    raster = BoundingBoxCollection(boxes._polygons(), photo)
+
+    boxes.collapse(geometric=True)
+    raster.collapse()
+
+    assert sorted(map(tuple, boxes.extents.tolist())) == sorted(
+        map(tuple, raster.extents.tolist()))
+
+
+def test_collapse_boxes_outside_the_photo(photo):
+    photo.img = np.zeros((50, 50), np.uint8)
+    boxes = BoundingBoxCollection([rectangle(70, 10, 10, 10)], photo)
+
+    boxes.collapse()
+
+    assert len(boxes) == 0
+
+
+def test_to_mask_matches_generated_mask(boxes):
+    np.testing.assert_array_equal(boxes.to_mask().to_dense(), boxes.generate_mask())
+
+
+def test_bounding_box_extent():
+    box = BoundingBox(np.array(rectangle(3, 4, 10, 20)), shape=(100, 100))
+
+    assert box.extent == (4, 24, 3, 13)
@@ -0,0 +1,77 @@
+import os
+import shutil
+
+import numpy as np
+
+from aerio.Cache import Cache
+from aerio.BoundingBoxCollection import BoundingBoxCollection
+from aerio.Photo import Photo
+
+
+def test_memoize_reuses_results(path, tmp_path):
+    cache = Cache(str(tmp_path / "cache"))
+    photo = Photo(path, lazy=True)
+    calls = []
+
+    def mean(photo, scale):
+        calls.append(scale)
+        return float(photo.img.mean()) * scale
+
+    first = cache.memoize(photo, "mean", mean, scale=2)
+    second = cache.memoize(Photo(path, lazy=True), "mean", mean, scale=2)
+    other = cache.memoize(photo, "mean", mean, scale=3)
+
+    assert first == second
+    assert other == first / 2 * 3
+    assert calls == [2, 3]
+
+
+def test_keys_follow_content(path, tmp_path):
+    cache = Cache(str(tmp_path / "cache"))
+    photo = Photo(path, lazy=True)
+    key = cache.key(photo, "op", {"a": 1})
+
+    # Unchanged copies of a file share keys, while crops, changes, and parameters don't
+    copy_path = str(tmp_path / "copy.tif")
+    shutil.copyfile(path, copy_path)
+    assert cache.key(Photo(copy_path, lazy=True), "op", {"a": 1}) == key
+    assert cache.key(photo, "op", {"a": 2}) != key
+
+    cropped = Photo(path, lazy=True)
+    cropped.crop(100, 100, lazy=True)
+    assert cache.key(cropped, "op", {"a": 1}) != key
+
+    photo.img = photo.img + 1
+    assert cache.key(photo, "op", {"a": 1}) != key
+
+
+def test_boxes_are_stored_without_their_photo(path, tmp_path):
+    cache = Cache(str(tmp_path / "cache"))
+    photo = Photo(path, lazy=True)
+
+    def boxes(photo):
+        return BoundingBoxCollection([[[0, 0], [10, 0], [10, 10], [0, 10]]], photo)
+
+    cache.memoize(photo, "boxes", boxes)
+    restored = cache.memoize(photo, "boxes", lambda photo: None)
+
+    assert restored.photo is photo
+    np.testing.assert_array_equal(restored.extents, [[0, 10, 0, 10]])
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache = Cache(str(tmp_path / "cache"), max_size=4000)
+
+    for i, key in enumerate("abc"):
+        cache.set(key, np.zeros(1000, np.uint8))
+        os.utime(cache._path(key), ns=(i * 10 ** 9, i * 10 ** 9))
+
+    cache.get("a")
+    cache.set("d", np.zeros(1000, np.uint8))
+
+    assert "a" in cache and "d" in cache
+    assert "b" not in cache
+    assert cache.size <= 4000
+
+    cache.clear()
+    assert cache.size == 0 and cache.get("a") is None
@@ -0,0 +1,165 @@
+import cv2
+import numpy as np
+import pytest
+
+from aerio.FiducialTemplate import FiducialTemplate
+from aerio.PhotoCollection import PhotoCollection
+
+
+SIZES = [(80, 120), (150, 150)]
+
+
+def located(paths, size, **kwargs):
+    collection = PhotoCollection(paths, lazy=True)
+    collection.locate_fiducials(size, **kwargs)
+
+    return collection
+
+
+@pytest.fixture(scope="module", params=SIZES)
+def size(request):
+    return request.param
+
+
+@pytest.fixture(scope="module")
+def default(paths, size):
+    """
+    Fiducials located in fully loaded photos with the default settings
+    """
+    collection = PhotoCollection(paths)
+    collection.locate_fiducials(size)
+
+    return collection
+
+
+def test_all_fiducials_are_located(default):
+    coordinates = default.fiducial_coordinates
+
+    assert coordinates.shape == (3, 4, 2)
+    assert np.isfinite(coordinates).all()
+
+
+def test_lazy_windows_match_loaded_photos(paths, size, default):
+    collection = located(paths, size)
+
+    assert not any(photo.is_loaded for photo in collection.photos)
+    np.testing.assert_array_equal(collection.fiducial_coordinates, default.fiducial_coordinates)
+
+
+@pytest.mark.parametrize("subpixel", [False, True])
+def test_batched_matches_per_photo(paths, size, subpixel):
+    single = located(paths, size, subpixel=subpixel)
+    batched = located(paths, size, batched=True, subpixel=subpixel)
+
+    np.testing.assert_allclose(batched.fiducial_coordinates, single.fiducial_coordinates,
+                               atol=1e-4)
+
+    for photo, other in zip(batched.photos, single.photos):
+        for fiducial, expected in zip(photo.fiducials.fiducials, other.fiducials.fiducials):
+            assert fiducial.quality["response"] == pytest.approx(expected.quality["response"],
+                                                                 rel=1e-4)
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_adaptive_matches_default_for_sampled_files(paths, size, default, batched):
+    repeated = paths * 3
+    collection = PhotoCollection(repeated, lazy=True)
+
+    # Every file is sampled, so every copy of it must get the same coordinates
+    windows = collection.locate_fiducials(size, adaptive=True, samples=3, batched=batched)
+
+    assert len(windows) == 4
+    np.testing.assert_array_equal(collection.fiducial_coordinates,
+                                  np.tile(default.fiducial_coordinates, (3, 1, 1)))
+
+
+def test_adaptive_windows_are_checked_against_samples(paths, size, default):
+    collection = PhotoCollection(paths, lazy=True)
+
+    windows = collection.locate_fiducials(size, adaptive=True, samples=3)
+
+    # Windows that were kept reproduce the full size results of the sampled photos
+    for position, window in enumerate(windows):
+        if window is None:
+            continue
+
+        for photo, expected in zip(collection.photos, default.fiducial_coordinates):
+            photo.fiducials.locate(size, windows=[window if i == position else None
+                                                  for i in range(4)])
+            np.testing.assert_array_equal(photo.fiducials.coordinates[position],
+                                          expected[position])
+
+
+def test_subpixel_stays_near_corner(default, paths, size):
+    collection = located(paths, size, subpixel=True)
+
+    difference = np.abs(collection.fiducial_coordinates - default.fiducial_coordinates)
+    assert difference.max() <= 1
+    assert (difference > 0).any()
+
+
+def test_quality_scores(default):
+    for photo in default.photos:
+        for fiducial in photo.fiducials.fiducials:
+            assert fiducial.quality["response"] > 0
+            assert fiducial.quality["score"] is None
+            assert fiducial.quality["symmetry"] >= 0
+            assert fiducial.quality["deviation"] >= 0
+
+
+def test_template_matches_reference_photo(paths, size, default):
+    template = FiducialTemplate(default[0].fiducials)
+    collection = located(paths, size, template=template)
+
+    np.testing.assert_allclose(collection.fiducial_coordinates[0],
+                               default.fiducial_coordinates[0], atol=0.5)
+
+    for fiducial in collection[0].fiducials.fiducials:
+        assert fiducial.quality["score"] == pytest.approx(1, abs=1e-3)
+        assert fiducial.quality["response"] is None
+
+
+def test_template_correlation_matches_opencv(default):
+    template = FiducialTemplate(default[0].fiducials)
+    img = default[1].fiducials.fiducials[2].img
+
+    expected = cv2.matchTemplate(np.float32(img), template.templates[2], cv2.TM_CCOEFF_NORMED)
+
+    np.testing.assert_allclose(template._correlate(2, img), expected, atol=1e-3)
+
+
+def test_template_save_and_load(default, tmp_path):
+    template = FiducialTemplate(default[0].fiducials)
+    path = str(tmp_path / "template.npz")
+
+    template.save(path)
+    loaded = FiducialTemplate.load(path)
+
+    for expected, actual in zip(template.templates, loaded.templates):
+        np.testing.assert_array_equal(actual, expected)
+    assert loaded.anchors == template.anchors
+
+
+def test_low_confidence_limits_apply_to_their_own_scores(paths, size, default):
+    template = FiducialTemplate(default[0].fiducials)
+    matched = located(paths, size, template=template)
+
+    # Corner responses are small eigenvalues, while template scores are correlations
+    assert default.low_confidence_fiducials(min_score=0.99) == []
+    assert len(default.low_confidence_fiducials(min_response=1e6)) == 12
+    assert matched.low_confidence_fiducials(min_response=1e6) == []
+    assert len(matched.low_confidence_fiducials(min_score=1.01)) == 12
+
+
+def test_retry_only_low_confidence_fiducials(paths, size):
+    collection = located(paths, size)
+    fiducials = [list(photo.fiducials.fiducials) for photo in collection.photos]
+    responses = [fiducial.quality["response"] for photo in fiducials for fiducial in photo]
+    limit = float(np.median(responses))
+
+    retried = collection.retry_fiducials((100, 150), min_response=limit)
+
+    assert retried and len(retried) < 12
+    for index, photo in enumerate(collection.photos):
+        for position, fiducial in enumerate(photo.fiducials.fiducials):
+            assert (fiducial is not fiducials[index][position]) == ((index, position) in retried)
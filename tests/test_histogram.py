@@ -0,0 +1,34 @@
+import numpy as np
+from skimage.exposure import match_histograms
+
+from aerio.Histogram import Histogram
+
+
+def test_uint8_matches_skimage():
+    rng = np.random.default_rng(0)
+    reference = rng.normal(120, 30, (200, 150)).clip(0, 255).astype(np.uint8)
+    img = rng.normal(80, 20, (180, 170)).clip(0, 255).astype(np.uint8)
+
+    np.testing.assert_array_equal(Histogram(reference).match(img),
+                                  match_histograms(img, reference).astype(np.uint8))
+
+
+def test_float_matches_skimage():
+    rng = np.random.default_rng(1)
+    reference = rng.normal(0.5, 0.1, (50, 60)).astype(np.float32)
+    img = rng.normal(0.2, 0.3, (40, 70)).astype(np.float32)
+
+    np.testing.assert_allclose(Histogram(reference).match(img),
+                               match_histograms(img, reference), rtol=1e-6)
+
+
+def test_uint16_output_type():
+    rng = np.random.default_rng(2)
+    reference = rng.integers(0, 4000, (30, 30), dtype=np.uint16)
+    img = rng.integers(0, 60000, (30, 30), dtype=np.uint16)
+
+    matched = Histogram(reference).match(img, np.uint8)
+
+    assert matched.dtype == np.uint8
+    np.testing.assert_array_equal(matched,
+                                  match_histograms(img, reference).astype(np.uint8))
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from aerio.InteriorOrientation import InteriorOrientation
+
+
+CALIBRATED = np.array([[0., -110.], [110., 0.], [0., 110.], [-110., 0.]])
+
+
+def photo_coordinates(transforms):
+    """
+    Return the fiducial coordinates that transforms map to the calibrated positions
+    """
+    inverse = np.linalg.inv(transforms)
+    points = np.concatenate((CALIBRATED, np.ones((4, 1))), axis=1) @ np.swapaxes(inverse, 1, 2)
+
+    return points[..., :2] / points[..., 2:]
+
+
+def random_affine(rng, n):
+    transforms = np.tile(np.eye(3), (n, 1, 1))
+    transforms[:, :2, :2] = np.eye(2) * rng.uniform(0.05, 0.2, (n, 1, 1)) + \
+        rng.normal(0, 0.01, (n, 2, 2))
+    transforms[:, :2, 2] = rng.uniform(-150, 150, (n, 2))
+
+    return transforms
+
+
+def test_affine_matches_least_squares():
+    rng = np.random.default_rng(0)
+    coordinates = photo_coordinates(random_affine(rng, 20)) + rng.normal(0, 0.5, (20, 4, 2))
+
+    orientation = InteriorOrientation(coordinates, CALIBRATED)
+
+    for photo, transform in zip(coordinates, orientation.transforms):
+        design = np.concatenate((photo, np.ones((4, 1))), axis=1)
+        solution, *_ = np.linalg.lstsq(design, CALIBRATED, rcond=None)
+
+        np.testing.assert_allclose(transform[:2], solution.T, atol=1e-8)
+
+    assert orientation.solved.all()
+    np.testing.assert_allclose(orientation.apply(coordinates), CALIBRATED - orientation.residuals)
+
+
+def test_projective_recovers_transforms():
+    rng = np.random.default_rng(1)
+    transforms = random_affine(rng, 5)
+    transforms[:, 2, :2] = rng.normal(0, 1e-5, (5, 2))
+    transforms /= transforms[:, 2:, 2:]
+
+    orientation = InteriorOrientation(photo_coordinates(transforms), CALIBRATED,
+                                      InteriorOrientation.PROJECTIVE)
+
+    np.testing.assert_allclose(orientation.transforms, transforms, rtol=1e-6, atol=1e-9)
+    np.testing.assert_allclose(orientation.rmse, 0, atol=1e-6)
+    np.testing.assert_allclose(orientation.inverse @ orientation.transforms,
+                               np.tile(np.eye(3), (5, 1, 1)), atol=1e-9)
+
+
+def test_missing_fiducials():
+    rng = np.random.default_rng(2)
+    coordinates = photo_coordinates(random_affine(rng, 3))
+    coordinates[1, 0] = np.nan
+    coordinates[2, :2] = np.nan
+
+    orientation = InteriorOrientation(coordinates, CALIBRATED)
+
+    np.testing.assert_array_equal(orientation.solved, [True, True, False])
+    np.testing.assert_allclose(orientation.residuals[1, 1:], 0, atol=1e-8)
+    assert np.isnan(orientation.rmse[2])
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        InteriorOrientation(np.zeros((2, 4, 2)), CALIBRATED, model="similarity")
+    with pytest.raises(ValueError):
+        InteriorOrientation(np.zeros((4, 2)), CALIBRATED)
@@ -0,0 +1,65 @@
+import os
+
+from aerio.Manifest import Manifest
+from aerio.Photo import Photo
+
+
+def test_records_are_kept_across_runs(path, tmp_path):
+    manifest_path = str(tmp_path / "manifest.jsonl")
+    output = tmp_path / "out.tif"
+    output.write_bytes(b"image")
+    photo = Photo(path, lazy=True)
+
+    manifest = Manifest(manifest_path)
+    signature = manifest.signature(photo, "steps", 1)
+    manifest.complete(photo, signature, str(output), fiducials=[[1.0, 2.0]])
+
+    reopened = Manifest(manifest_path)
+    record = reopened.get(photo, signature)
+
+    assert len(reopened) == 1
+    assert record["fiducials"] == [[1.0, 2.0]]
+    assert reopened.get(photo, reopened.signature(photo, "steps", 2)) is None
+
+
+def test_changed_or_missing_outputs_are_redone(path, tmp_path):
+    output = tmp_path / "out.tif"
+    output.write_bytes(b"image")
+    photo = Photo(path, lazy=True)
+    manifest = Manifest(str(tmp_path / "manifest.jsonl"))
+    signature = manifest.signature(photo)
+    manifest.complete(photo, signature, str(output))
+
+    output.write_bytes(b"partial")
+    assert manifest.get(photo, signature) is None
+
+    os.remove(output)
+    assert manifest.get(photo, signature) is None
+
+
+def test_modified_images_change_the_signature(path, tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.jsonl"))
+    photo = Photo(path, lazy=True)
+    signature = manifest.signature(photo)
+
+    photo.img = photo.img // 2
+
+    assert manifest.signature(photo) != signature
+
+
+def test_truncated_lines_are_ignored(path, tmp_path):
+    manifest_path = tmp_path / "manifest.jsonl"
+    output = tmp_path / "out.tif"
+    output.write_bytes(b"image")
+    photo = Photo(path, lazy=True)
+
+    manifest = Manifest(str(manifest_path))
+    manifest.complete(photo, "first", str(output))
+    with open(manifest_path, "a") as f:
+        f.write('{"source": "cut off')
+
+    manifest.complete(photo, "second", str(output))
+
+    reopened = Manifest(str(manifest_path))
+    assert reopened.get(photo, "second") is not None
+    assert reopened.get(photo, "first") is None
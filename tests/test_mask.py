@@ -0,0 +1,125 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from aerio.Mask import Mask
+
+
+SHAPE = (120, 90)
+
+
+@pytest.fixture
+def polygons():
+    return [np.array([[5, 5], [40, 5], [40, 30], [5, 30]]),
+            np.array([[60, 50], [85, 70], [50, 110]]),
+            np.array([[0, 115], [89, 115], [89, 119], [0, 119]])]
+
+
+@pytest.fixture
+def dense(polygons):
+    return Mask(SHAPE, polygons=polygons).to_dense()
+
+
+def forms(dense):
+    packed = Mask.from_array(dense)
+
+    return [packed, Mask(SHAPE, runs=packed.runs)]
+
+
+def test_forms_match_polygons(polygons, dense):
+    mask = Mask(SHAPE, polygons=polygons)
+
+    for converted in [Mask(SHAPE, packed=mask.packed), Mask(SHAPE, runs=mask.runs)] + forms(dense):
+        np.testing.assert_array_equal(converted.to_dense(), dense)
+        assert converted.area == np.count_nonzero(dense == 0)
+
+
+@pytest.mark.parametrize("channels", [None, 3])
+def test_fill_matches_dense(polygons, dense, channels):
+    shape = SHAPE if channels is None else SHAPE + (channels,)
+    img = np.random.default_rng(0).integers(1, 255, shape, dtype=np.uint8)
+    selected = dense == 0 if channels is None else (dense == 0)[..., np.newaxis]
+    expected = np.where(selected, 0, img)
+
+    for mask in [Mask(SHAPE, polygons=polygons)] + forms(dense):
+        filled = img.copy()
+        mask.fill(filled, 0)
+        np.testing.assert_array_equal(filled, expected)
+
+
+def test_fill_in_chunks(monkeypatch, dense):
+    monkeypatch.setattr(Mask, "CHUNK_SIZE", 64)
+    img = np.full(SHAPE, 9, np.uint8)
+
+    for mask in forms(dense):
+        filled = img.copy()
+        mask.fill(filled, 1)
+        np.testing.assert_array_equal(filled, np.where(dense == 0, 1, 9))
+
+
+def test_fill_long_runs_without_index_arrays():
+    shape = (2000, 2000)
+    img = np.full(shape, 9, np.uint8)
+    expected = img.copy().ravel()
+    expected[5:10] = expected[20:] = 1
+
+    tracemalloc.start()
+    Mask(shape, runs=[5, 5, 10, img.size - 20]).fill(img, 1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    np.testing.assert_array_equal(img.ravel(), expected)
+    assert peak < img.nbytes
+
+
+def test_fill_rejects_mismatched_arrays(dense):
+    mask = Mask.from_array(dense)
+
+    with pytest.raises(ValueError):
+        mask.fill(np.zeros((10, 10), np.uint8))
+    with pytest.raises(ValueError):
+        mask.fill(np.zeros((SHAPE[1], SHAPE[0]), np.uint8).T)
+
+
+@pytest.mark.parametrize("form", [Mask.POLYGONS, Mask.PACKED, Mask.RLE])
+def test_save_and_load(tmp_path, polygons, dense, form):
+    path = str(tmp_path / "mask.npz")
+
+    Mask(SHAPE, polygons=polygons).save(path, form=form)
+    loaded = Mask.load(path)
+
+    assert loaded.shape == SHAPE
+    np.testing.assert_array_equal(loaded.to_dense(), dense)
+
+
+def test_combine(dense):
+    other = np.full(SHAPE, 255, np.uint8)
+    other[20:60, 20:60] = 0
+    expected_union = (dense == 0) | (other == 0)
+    expected_intersection = (dense == 0) & (other == 0)
+
+    for first in forms(dense):
+        for second in forms(other):
+            np.testing.assert_array_equal((first | second).to_dense() == 0, expected_union)
+            np.testing.assert_array_equal((first & second).to_dense() == 0, expected_intersection)
+
+    with pytest.raises(ValueError):
+        Mask.from_array(dense) | Mask.from_array(dense[:10])
+
+
+def test_polygons_outside_the_mask(tmp_path, dense):
+    mask = Mask((3, 43), polygons=[np.array([[5, 5], [40, 5], [40, 30], [5, 30]])])
+
+    assert mask.area == 0
+    np.testing.assert_array_equal(mask.runs, [3 * 43])
+    mask.save(str(tmp_path / "mask.npz"), form=Mask.RLE)
+
+    other = Mask(SHAPE, polygons=[np.array([[-20, 5], [-5, 5], [-5, 30]])])
+    assert (other | Mask.from_array(dense)).area == np.count_nonzero(dense == 0)
+    assert (other & Mask.from_array(dense)).area == 0
+
+
+def test_mask_requires_a_form():
+    with pytest.raises(ValueError):
+        Mask(SHAPE)
@@ -0,0 +1,154 @@
+import os
+
+import cv2
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from aerio.Photo import Photo
+
+
+def test_lazy_photo_reads_size_without_loading(path):
+    eager = Photo(path)
+    lazy = Photo(path, lazy=True)
+
+    assert lazy.size == eager.size
+    assert not lazy.is_loaded
+
+    np.testing.assert_array_equal(lazy.img, eager.img)
+    assert lazy.is_loaded
+
+
+def test_release_reads_image_again(path):
+    photo = Photo(path, lazy=True)
+    img = photo.img.copy()
+
+    photo.release()
+
+    assert not photo.is_loaded
+    np.testing.assert_array_equal(photo.img, img)
+
+
+def test_header_dpi(tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    tiff_path = str(tmp_path / "scan.tif")
+    tifffile.imwrite(tiff_path, np.zeros((40, 60), np.uint8), resolution=(300, 300),
+                     resolutionunit=2)
+
+    photo = Photo(tiff_path, lazy=True, dpi_from_header=True)
+
+    assert photo.header_dpi == (300, 300)
+    assert photo.dpi == 300
+    assert photo.size == (40, 60)
+    assert not photo.is_loaded
+
+
+def test_crop_within_image_is_a_view(path):
+    photo = Photo(path)
+    img = photo.img
+
+    photo.crop(1000, 1200)
+
+    assert photo.size == (1000, 1200)
+    assert np.shares_memory(photo.img, img)
+    np.testing.assert_array_equal(photo.img, img[:1000, :1200])
+
+
+def test_crop_larger_than_image_fills(path):
+    photo = Photo(path)
+    height, width = photo.size
+
+    photo.crop(height + 10, width + 5, fill=7)
+
+    assert photo.size == (height + 10, width + 5)
+    assert (photo.img[height:] == 7).all() and (photo.img[:, width:] == 7).all()
+
+
+@pytest.mark.parametrize("size", [(1000, 1200), (1900, 1890)])
+def test_lazy_crop_matches_eager_crop(path, size):
+    eager = Photo(path)
+    eager.crop(*size, fill=3)
+
+    lazy = Photo(path, lazy=True)
+    lazy.crop(*size, fill=3, lazy=True)
+
+    assert not lazy.is_loaded
+    assert lazy.size == size
+    np.testing.assert_array_equal(lazy.img, eager.img)
+
+
+@pytest.mark.parametrize("crop", [None, (1000, 1890)])
+def test_read_window_matches_image(path, crop):
+    eager = Photo(path)
+    lazy = Photo(path, lazy=True)
+
+    if crop:
+        eager.crop(*crop, fill=5)
+        lazy.crop(*crop, fill=5, lazy=True)
+
+    for window in [(0, 80, 900, 1020), (950, 1000, 1800, 1880), (10, 20, 30, 40)]:
+        np.testing.assert_array_equal(lazy.read_window(*window), eager.img[window[0]:window[1],
+                                                                           window[2]:window[3]])
+
+    assert not lazy.is_loaded
+
+
+def test_memmap_matches_eager(path, tmp_path):
+    eager = Photo(path)
+    mapped = Photo(path, lazy=True, memmap_dir=str(tmp_path))
+
+    np.testing.assert_array_equal(mapped.img, eager.img)
+    assert isinstance(mapped.img, np.memmap)
+    assert os.path.exists(mapped.memmap_path)
+
+
+def test_pyramid_levels(path, tmp_path):
+    photo = Photo(path, lazy=True, pyramid_dir=str(tmp_path))
+
+    expected = cv2.pyrDown(cv2.pyrDown(photo.img))
+    np.testing.assert_array_equal(photo.level(2), expected)
+    assert os.path.exists(photo.level_path(2))
+
+    # Saved levels are read instead of being rebuilt
+    reopened = Photo(path, lazy=True, pyramid_dir=str(tmp_path))
+    np.testing.assert_array_equal(reopened.level(2), expected)
+    assert not reopened.is_loaded
+
+
+def test_pyramid_levels_follow_image_changes(path):
+    photo = Photo(path)
+    photo.level(1)
+
+    photo.crop(1000, 1000)
+
+    np.testing.assert_array_equal(photo.level(1), cv2.pyrDown(photo.img))
+
+    with pytest.raises(ValueError):
+        photo.level(-1)
+
+
+def test_preview_uses_full_resolution_extent(path):
+    photo = Photo(path, lazy=True)
+    _, ax = plt.subplots(nrows=2, figsize=(2, 4))
+
+    photo.preview(ax=ax, index=0)
+
+    image = ax[0].get_images()[0]
+    assert image.get_array().shape[0] < photo.height
+    np.testing.assert_allclose(image.get_extent(), photo.preview_extent)
+    plt.close("all")
+
+
+def test_rectify_matches_warp(path):
+    photo = Photo(path)
+    img = photo.img.copy()
+    affine = np.array([[1, 0.01, 5], [-0.01, 1, -3], [0, 0, 1]])
+    projective = np.array([[1, 0, 2], [0, 1, 1], [1e-5, 2e-5, 1]])
+
+    photo.rectify(affine)
+    np.testing.assert_array_equal(photo.img, cv2.warpAffine(img, affine[:2], img.shape[::-1]))
+
+    photo.img = img
+    photo.rectify(projective, size=(1000, 900), fill=9)
+    np.testing.assert_array_equal(photo.img, cv2.warpPerspective(img, projective, (900, 1000),
+                                                                 borderValue=9))
@@ -0,0 +1,238 @@
+import os
+
+import cv2
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+from skimage.exposure import match_histograms
+
+from aerio.BoundingBoxCollection import BoundingBoxCollection
+from aerio.Cache import Cache
+from aerio.FiducialTemplate import FiducialTemplate
+from aerio.Mask import Mask
+from aerio.Photo import Photo
+from aerio.PhotoCollection import PhotoCollection
+
+
+EXECUTORS = [("serial", None), ("thread", 2), ("process", 2)]
+
+
+def process(collection):
+    collection.crop()
+    collection.match_histograms()
+    collection.locate_fiducials((80, 120))
+
+    return collection
+
+
+@pytest.fixture(scope="module")
+def processed(paths):
+    return process(PhotoCollection(paths))
+
+
+def label_boxes(photo):
+    return BoundingBoxCollection([[[100, 200], [400, 200], [400, 260], [100, 260]],
+                                  [[900, 900], [950, 900], [950, 1300]]], photo)
+
+
+def test_processing_matches_original_operations(paths, processed):
+    photos = [Photo(path) for path in paths]
+    height = min(photo.height for photo in photos)
+    width = min(photo.width for photo in photos)
+    imgs = [photo.img[:height, :width] for photo in photos]
+
+    for img, photo in zip(imgs, processed.photos):
+        np.testing.assert_array_equal(photo.img, np.uint8(match_histograms(img, imgs[0])))
+
+
+@pytest.mark.parametrize("kind, workers", EXECUTORS)
+def test_executors_match_serial(paths, processed, kind, workers):
+    collection = process(PhotoCollection(paths, lazy=True, executor=kind, workers=workers))
+
+    for photo, expected in zip(collection.photos, processed.photos):
+        np.testing.assert_array_equal(photo.img, expected.img)
+    np.testing.assert_array_equal(collection.fiducial_coordinates, processed.fiducial_coordinates)
+
+
+@pytest.mark.parametrize("kind, workers", EXECUTORS)
+def test_template_matching_executors(paths, processed, kind, workers):
+    template = FiducialTemplate(processed[0].fiducials)
+    serial = PhotoCollection(paths, lazy=True)
+    serial.locate_fiducials((80, 120), template=template)
+
+    collection = PhotoCollection(paths, lazy=True, executor=kind, workers=workers)
+    collection.locate_fiducials((80, 120), template=template)
+
+    np.testing.assert_array_equal(collection.fiducial_coordinates, serial.fiducial_coordinates)
+
+
+def test_invalid_executor(paths):
+    with pytest.raises(ValueError):
+        PhotoCollection(paths, lazy=True, executor="cluster")
+
+
+def test_reduced_reference_histogram(paths):
+    collection = PhotoCollection(paths)
+    collection.match_histograms(reference_level=1)
+
+    assert all(photo.img.dtype == np.uint8 for photo in collection.photos)
+
+
+def test_pipeline_matches_collection_methods(paths, processed, tmp_path):
+    collection = PhotoCollection(paths, lazy=True)
+    pipeline = collection.pipeline(["crop", "match_histograms",
+                                    ("locate_fiducials", {"size": (80, 120)})])
+
+    out_paths = pipeline.run(str(tmp_path))
+
+    assert not any(photo.is_loaded for photo in collection.photos)
+    np.testing.assert_array_equal(collection.fiducial_coordinates, processed.fiducial_coordinates)
+    for out_path, photo in zip(out_paths, processed.photos):
+        np.testing.assert_array_equal(cv2.imread(out_path, cv2.IMREAD_GRAYSCALE), photo.img)
+
+
+@pytest.mark.parametrize("step", ["sharpen", "size", ("locate_fiducials", {"batched": True}),
+                                  ("match_histograms", {"cache": None}),
+                                  ("crop", {"height": 100, "depth": 3})])
+def test_invalid_pipeline_step(paths, step):
+    # Steps are checked before anything is processed
+    with pytest.raises(ValueError):
+        PhotoCollection(paths, lazy=True).pipeline([step])
+
+
+def test_pipeline_resumes_from_manifest(paths, tmp_path):
+    steps = ["crop", ("locate_fiducials", {"size": (80, 120)})]
+    manifest = str(tmp_path / "manifest.jsonl")
+
+    first = PhotoCollection(paths, lazy=True)
+    out_paths = first.pipeline(steps).run(str(tmp_path), manifest=manifest)
+    mtimes = [os.path.getmtime(out_path) for out_path in out_paths]
+
+    # Removing an output makes only that photo run again
+    os.remove(out_paths[1])
+    resumed = PhotoCollection(paths, lazy=True)
+    assert resumed.pipeline(steps).run(str(tmp_path), manifest=manifest) == out_paths
+
+    assert [os.path.getmtime(out_path) for out_path in out_paths[::2]] == mtimes[::2]
+    assert os.path.exists(out_paths[1])
+    np.testing.assert_array_equal(resumed.fiducial_coordinates, first.fiducial_coordinates)
+
+    # Restored fiducials have coordinates but no image
+    restored = resumed[0].fiducials.top
+    assert restored.img is None
+    _, ax = plt.subplots(nrows=3)
+    resumed.preview()
+    resumed[0].preview(ax=ax, index=0)
+    resumed.interior_orientation(resumed.fiducial_coordinates[0])
+    with pytest.raises(ValueError):
+        restored.preview()
+    with pytest.raises(ValueError):
+        FiducialTemplate(resumed[0].fiducials)
+    plt.close("all")
+
+
+def test_save_masks_matches_apply_mask(paths, tmp_path):
+    collection = PhotoCollection(paths, lazy=True)
+    boxes = label_boxes(collection[0])
+    masks = [boxes, Mask.from_array(boxes.generate_mask()), None]
+
+    out_paths = collection.save(str(tmp_path), masks=masks, fill=7)
+
+    for out_path, photo, mask in zip(out_paths, collection.photos, masks):
+        expected = Photo(photo.path)
+        if mask is not None:
+            expected.apply_mask(mask, fill=7)
+
+        np.testing.assert_array_equal(cv2.imread(out_path, cv2.IMREAD_GRAYSCALE), expected.img)
+        # Saving doesn't mask the photos themselves
+        np.testing.assert_array_equal(photo.img, Photo(photo.path).img)
+
+    with pytest.raises(ValueError):
+        collection.save(str(tmp_path), masks=masks[:2])
+
+
+def test_save_resumes_from_manifest(paths, tmp_path):
+    manifest = str(tmp_path / "saved.jsonl")
+    collection = PhotoCollection(paths, lazy=True)
+    masks = [Mask(photo.size, runs=Mask.from_array(label_boxes(photo).generate_mask()).runs)
+             for photo in collection.photos]
+
+    out_paths = collection.save(str(tmp_path), masks=masks, manifest=manifest)
+    mtimes = [os.path.getmtime(out_path) for out_path in out_paths]
+
+    resumed = PhotoCollection(paths, lazy=True)
+    assert resumed.save(str(tmp_path), masks=masks, manifest=manifest) == out_paths
+    assert [os.path.getmtime(out_path) for out_path in out_paths] == mtimes
+
+    # Signatures hash the stored form of masks without converting them
+    assert all(repr(mask).endswith("rle)") for mask in masks)
+
+    # A different fill changes the output, so every photo is saved again
+    resumed.save(str(tmp_path), masks=masks, fill=9, manifest=manifest)
+    assert all(os.path.getmtime(out_path) >= mtime for out_path, mtime in zip(out_paths, mtimes))
+    assert cv2.imread(out_paths[0], cv2.IMREAD_GRAYSCALE)[220, 200] == 9
+
+
+def test_cached_results_match_computed_results(paths, processed, tmp_path):
+    cache = Cache(str(tmp_path / "cache"))
+    sizes = []
+
+    for _ in range(2):
+        collection = PhotoCollection(paths, lazy=True)
+        collection.crop()
+        collection.match_histograms(cache=cache)
+        collection.locate_fiducials((80, 120), cache=cache)
+        sizes.append(cache.size)
+
+        for photo, expected in zip(collection.photos, processed.photos):
+            np.testing.assert_array_equal(photo.img, expected.img)
+        np.testing.assert_array_equal(collection.fiducial_coordinates,
+                                      processed.fiducial_coordinates)
+
+    # The second run only reads stored results
+    assert sizes[0] > 0 and sizes[1] == sizes[0]
+
+    with pytest.raises(ValueError):
+        collection.locate_fiducials((80, 120), adaptive=True, cache=cache)
+
+
+def test_interior_orientation(processed):
+    calibrated = processed.fiducial_coordinates.mean(axis=0)
+
+    orientation = processed.interior_orientation(calibrated)
+
+    assert orientation.solved.all()
+    np.testing.assert_allclose(orientation.apply(processed.fiducial_coordinates),
+                               calibrated - orientation.residuals)
+
+
+def test_rectify_matches_warp(paths):
+    collection = PhotoCollection(paths)
+    collection.locate_fiducials((80, 120))
+    imgs = [photo.img for photo in collection.photos]
+    transforms = collection._frame_transforms(None, "affine")
+    size = (max(img.shape[0] for img in imgs), max(img.shape[1] for img in imgs))
+
+    collection.rectify()
+
+    for photo, img, transform in zip(collection.photos, imgs, transforms):
+        np.testing.assert_array_equal(photo.img,
+                                      cv2.warpAffine(img, transform[:2], size[::-1]))
+
+
+def test_rectify_streams_to_disk(paths, tmp_path):
+    collection = PhotoCollection(paths, lazy=True)
+    shift = np.array([[1, 0, 4], [0, 1, -2], [0, 0, 1]], dtype=np.float64)
+
+    out_paths = collection.rectify(str(tmp_path), transforms=shift, size=(1000, 1000),
+                                   release=True)
+
+    assert not any(photo.is_loaded for photo in collection.photos)
+    for out_path, path in zip(out_paths, paths):
+        expected = cv2.warpAffine(Photo(path).img, shift[:2], (1000, 1000))
+        np.testing.assert_array_equal(cv2.imread(out_path, cv2.IMREAD_GRAYSCALE), expected)
+
+
+def test_rectify_requires_fiducials(paths):
+    with pytest.raises(ValueError):
+        PhotoCollection(paths, lazy=True).rectify()